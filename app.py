@@ -1,36 +1,97 @@
 import os
+import json
 import logging
 import tempfile
 import uuid
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+import hashlib
+from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import whisper_utils
+import audio_cache
+import concurrency_governor
+import decode_presets
+import job_scheduler
 import subtitle_formatter
+import video_muxer
 import gofile_client  # Import Gofile client
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Make WebSocket support conditional to avoid errors if the package is not installed
+try:
+    from flask_sock import Sock
+    import streaming_transcriber
+    WEBSOCKET_IMPORT_SUCCESS = True
+except ImportError:
+    logger.warning("flask-sock package not installed. Install it with 'pip install flask-sock' to enable live streaming")
+    WEBSOCKET_IMPORT_SUCCESS = False
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 
 # Configuration
 UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'mp3', 'mp4', 'wav', 'avi', 'mov', 'flac', 'ogg', 'm4a', 'webm'}
+ALLOWED_EXTENSIONS = whisper_utils.SUPPORTED_EXTENSIONS
 MAX_CONTENT_LENGTH = 200 * 1024 * 1024  # 200MB max file size
 
+# Decoding tasks run for each value of the task form field
+TRANSCRIPTION_TASKS = {
+    'transcribe': ('transcribe',),
+    'translate': ('translate',),
+    'both': ('transcribe', 'translate')
+}
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
 # Check if Gofile token is properly configured
 GOFILE_CONFIGURED = bool(os.environ.get("GOFILE_ACCOUNT_TOKEN") or "zlIFYhO5jHt5kVnN6Orit3jM0hEZA8LX")
 
+# API keys allowed to submit jobs in the interactive priority class
+PRIORITY_API_KEYS = set(filter(None, os.environ.get("WHISPER_PRIORITY_API_KEYS", "").split(",")))
+
+# API keys accounted as their own client by the scheduler (priority keys included)
+API_KEYS = set(filter(None, os.environ.get("WHISPER_API_KEYS", "").split(","))) | PRIORITY_API_KEYS
+
+# Request threads of the server process (keep in sync with gunicorn --threads in .replit)
+SERVER_THREADS = int(os.environ.get("WHISPER_SERVER_THREADS", "8"))
+SERVER_THREAD_HEADROOM = 2  # Threads kept free for status, download and static requests
+
+# Every queued or running job holds a server thread, and so does every live stream
+STREAM_THREADS = streaming_transcriber.MAX_STREAMS if WEBSOCKET_IMPORT_SUCCESS else 0
+MAX_QUEUED_JOBS = max(0, SERVER_THREADS - SERVER_THREAD_HEADROOM - STREAM_THREADS
+                      - concurrency_governor.governor.shared_slots)
+
+# Fair-share scheduler in front of the Whisper models, leaving out the slots reserved for live streams
+scheduler = job_scheduler.FairScheduler(concurrency_governor.governor.shared_slots, max_queued=MAX_QUEUED_JOBS)
+
 # Helper functions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_client_id():
+    """Identify the client a job is accounted to: its API key if configured, or else its session."""
+    # Unknown keys are ignored, otherwise a new key per request would get a fresh fair share
+    api_key = request.headers.get('X-API-Key')
+    if api_key in API_KEYS:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    
+    if 'client_id' not in session:
+        session['client_id'] = str(uuid.uuid4())
+    return 'session:' + session['client_id']
+
+def get_priority():
+    """Return the requested priority class, reserving interactive for trusted API keys."""
+    priority = request.form.get('priority', 'normal')
+    if priority not in job_scheduler.PRIORITY_CLASSES:
+        priority = 'normal'
+    if priority == 'interactive' and request.headers.get('X-API-Key') not in PRIORITY_API_KEYS:
+        priority = 'normal'
+    return priority
+
 # Routes
 @app.route('/')
 def index():
@@ -40,7 +101,11 @@ def index():
     # Get supported languages
     languages = whisper_utils.get_supported_languages()
     
-    return render_template('index.html', models=models, languages=languages)
+    # Get decoding speed presets
+    presets = decode_presets.PRESET_DESCRIPTIONS
+    
+    return render_template('index.html', models=models, languages=languages, presets=presets,
+                           default_preset=decode_presets.DEFAULT_PRESET)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -74,7 +139,8 @@ def upload_file():
         return jsonify({
             'message': 'File uploaded successfully',
             'filename': original_filename,
-            'status': 'ready'
+            'status': 'ready',
+            'has_video': file_extension in video_muxer.VIDEO_EXTENSIONS
         })
     
     except Exception as e:
@@ -87,30 +153,58 @@ def transcribe():
         # Get parameters from request
         model_name = request.form.get('model', 'base')
         language = request.form.get('language', None)
-        task = request.form.get('task', 'transcribe')  # 'transcribe' or 'translate'
+        task = request.form.get('task', 'transcribe')  # 'transcribe', 'translate' or 'both'
+        preset = request.form.get('preset', decode_presets.DEFAULT_PRESET)
         
         # Check if file path exists in session
         if 'file_path' not in session:
             return jsonify({'error': 'No file has been uploaded'}), 400
         
+        if task not in TRANSCRIPTION_TASKS:
+            return jsonify({'error': f'Unsupported task: {task}'}), 400
+        
+        if preset not in decode_presets.DECODE_PRESETS:
+            return jsonify({'error': f'Unsupported decoding preset: {preset}'}), 400
+        
         file_path = session['file_path']
         
         # Update status to processing
         response = {'status': 'processing'}
         
-        # Process the file with Whisper
-        logger.info(f"Starting transcription with model: {model_name}, language: {language}, task: {task}")
-        result = whisper_utils.transcribe_audio(file_path, model_name, language, task)
+        # Estimate the job's cost so the scheduler can share capacity fairly
+        tasks = TRANSCRIPTION_TASKS[task]
+        duration = whisper_utils.get_media_duration(file_path)
+        cost = job_scheduler.estimate_cost(duration, model_name, len(tasks))
         
-        # Store the result and processing parameters in session for later use
-        session['transcription_result'] = result
+        # Process the file with Whisper, decoding the media only once for all tracks
+        logger.info(f"Starting transcription with model: {model_name}, language: {language}, task: {task}, preset: {preset}")
+        try:
+            results = scheduler.run(
+                get_client_id(),
+                cost,
+                lambda: whisper_utils.transcribe_multi_task(file_path, model_name, language, tasks, preset=preset),
+                priority=get_priority()
+            )
+        except job_scheduler.SchedulerBusy as busy:
+            response = jsonify({
+                'error': 'The server is busy. Please try again later.',
+                'estimated_wait': round(busy.estimated_wait),
+                'retry_after': busy.retry_after
+            })
+            response.headers['Retry-After'] = str(busy.retry_after)
+            return response, 429
+        result = next(iter(results.values()))
+        
+        # Store the results and processing parameters in session for later use
+        session['transcription_results'] = results
         session['model_name'] = model_name
         session['task'] = task
         
         return jsonify({
             'status': 'completed',
             'message': 'Transcription completed successfully',
-            'preview': result['text'][:500] + ('...' if len(result['text']) > 500 else '')
+            'preview': result['text'][:500] + ('...' if len(result['text']) > 500 else ''),
+            'tracks': list(results.keys())
         })
     
     except Exception as e:
@@ -121,7 +215,7 @@ def transcribe():
 def download_subtitles():
     try:
         # Check if transcription result exists in session
-        if 'transcription_result' not in session:
+        if 'transcription_results' not in session:
             return jsonify({'error': 'No transcription found. Please transcribe a file first.'}), 400
         
         # Get format from request
@@ -131,8 +225,17 @@ def download_subtitles():
         original_filename = session.get('original_filename', 'subtitles')
         base_filename = os.path.splitext(original_filename)[0]
         
-        # Format the subtitles
-        result = session['transcription_result']
+        # Pick the requested track when several tasks ran in one job
+        results = session['transcription_results']
+        track = request.form.get('track') or next(iter(results))
+        if track not in results:
+            return jsonify({'error': f'No {track} track available for this file'}), 400
+        
+        result = results[track]
+        if len(results) > 1:
+            # Suffix the track so both can sit side by side, even when the source is English
+            track_suffix = 'en-translated' if track == 'translate' else result.get('language', track)
+            base_filename = f"{base_filename}.{track_suffix}"
         
         if subtitle_format == 'srt':
             content, output_filename = subtitle_formatter.to_srt(result, base_filename)
@@ -153,7 +256,7 @@ def download_subtitles():
                 # Get language info from result
                 detected_language = result.get('language', 'unknown')
                 model_name = session.get('model_name', 'base')
-                task = session.get('task', 'transcribe')
+                task = track
                 
                 # Additional metadata for the file
                 metadata = {
@@ -195,6 +298,61 @@ def download_subtitles():
         logger.error(f"Download error: {str(e)}")
         return jsonify({'error': f'An error occurred during subtitle generation: {str(e)}'}), 500
 
+@app.route('/mux', methods=['POST'])
+def mux_subtitles():
+    """
+    Stream the original upload with the subtitle tracks attached, without re-encoding.
+    """
+    try:
+        # Check if the upload and its transcription still exist
+        if 'transcription_results' not in session:
+            return jsonify({'error': 'No transcription found. Please transcribe a file first.'}), 400
+        
+        file_path = session.get('file_path')
+        if not file_path or not os.path.exists(file_path):
+            return jsonify({'error': 'The uploaded file is no longer available. Please upload it again.'}), 400
+        
+        if file_path.rsplit('.', 1)[-1].lower() not in video_muxer.VIDEO_EXTENSIONS:
+            return jsonify({'error': 'Subtitles can only be added to video files.'}), 400
+        
+        # Get container and tracks from request (all tracks by default)
+        container = request.form.get('container', 'mkv')
+        if container not in video_muxer.CONTAINERS:
+            return jsonify({'error': f'Unsupported container: {container}'}), 400
+        
+        results = session['transcription_results']
+        requested = request.form.getlist('track') or list(results.keys())
+        missing = [track for track in requested if track not in results]
+        if missing:
+            return jsonify({'error': f'No {", ".join(missing)} track available for this file'}), 400
+        
+        tracks = []
+        for track in requested:
+            result = results[track]
+            language = 'en' if track == 'translate' else result.get('language', 'und')
+            title = 'English (translated)' if track == 'translate' else whisper_utils.LANGUAGE_MAP.get(language, language)
+            tracks.append((result, language, title))
+        
+        original_filename = session.get('original_filename', 'video')
+        output_filename = f"{os.path.splitext(original_filename)[0]}.subtitled.{container}"
+        
+        # The page checks the request first, then lets the browser download the video natively
+        if request.form.get('check'):
+            return jsonify({'status': 'ok', 'filename': output_filename})
+        
+        # Start FFmpeg; input errors surface here before any bytes are sent
+        stream = video_muxer.stream_muxed_video(file_path, tracks, container)
+        
+        return Response(
+            stream_with_context(stream),
+            mimetype=video_muxer.CONTAINERS[container]['mimetype'],
+            headers={'Content-Disposition': f'attachment; filename="{output_filename}"'}
+        )
+    
+    except Exception as e:
+        logger.error(f"Mux error: {str(e)}")
+        return jsonify({'error': f'An error occurred while adding subtitles to the video: {str(e)}'}), 500
+
 @app.route('/download-complete', methods=['POST'])
 def download_complete():
     """
@@ -236,6 +394,7 @@ def clear_session():
     # Clear session data and remove temporary files
     if 'file_path' in session:
         try:
+            audio_cache.evict(session['file_path'])
             os.remove(session['file_path'])
         except Exception as e:
             logger.warning(f"Error removing temp file: {str(e)}")
@@ -269,6 +428,37 @@ def get_subtitle_link(file_id):
         logger.error(f"Error getting download link: {str(e)}")
         return jsonify({'error': f'An error occurred while retrieving the download link: {str(e)}'}), 500
         
+@app.route('/stats')
+def get_stats():
+    """
+    Report inference capacity and utilization for this host.
+    """
+    return jsonify({
+        'concurrency': concurrency_governor.governor.get_stats(),
+        'scheduler': scheduler.get_stats(),
+        'audio_cache': audio_cache.get_stats(),
+        'decoding': decode_presets.get_stats()
+    })
+
+if WEBSOCKET_IMPORT_SUCCESS:
+    sock = Sock(app)
+    
+    @sock.route('/stream')
+    def stream_transcription(ws):
+        """
+        Live captions over a WebSocket: raw 16kHz PCM or Ogg/WebM Opus frames in,
+        partial and final segments out, and an SRT of the whole stream at the end.
+        """
+        try:
+            streaming_transcriber.handle_websocket(ws)
+        except Exception as e:
+            logger.error(f"Streaming transcription error: {str(e)}")
+            try:
+                ws.send(json.dumps({'type': 'error', 'error': f'Streaming transcription failed: {str(e)}'}))
+            except Exception:
+                # The client is already gone
+                pass
+
 @app.errorhandler(413)
 def request_entity_too_large(error):
     return jsonify({'error': f'File too large. Maximum allowed size is {MAX_CONTENT_LENGTH / (1024 * 1024)}MB'}), 413
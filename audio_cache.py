@@ -0,0 +1,136 @@
+"""
+Decoded-audio cache for the subtitle generator app.
+This module stores the 16kHz float32 samples of each upload once as a .npy
+file and hands out memory-mapped views of it, so retries with a different
+model, language or task (and chunked decoding of long files) skip FFmpeg.
+
+Entries are evicted together with their upload, and the least recently used
+entries are dropped when the cache grows past its size limit.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cache configuration (can be overridden with environment variables)
+CACHE_DIR = os.environ.get("WHISPER_AUDIO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "whisper_audio_cache"))
+MAX_CACHE_BYTES = int(os.environ.get("WHISPER_AUDIO_CACHE_MAX_BYTES", str(4 * 1024 ** 3)))
+
+_stats_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+def _cache_path(file_path):
+    """Return the cache file for an upload, keyed on its path, size and modification time."""
+    stat = os.stat(file_path)
+    identity = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return os.path.join(CACHE_DIR, hashlib.sha1(identity.encode("utf-8")).hexdigest() + ".npy")
+
+def _count(hit):
+    global _hits, _misses
+    with _stats_lock:
+        if hit:
+            _hits += 1
+        else:
+            _misses += 1
+
+def load_audio(file_path, decode):
+    """
+    Return the decoded samples of an upload as a memory-mapped array.
+
+    Args:
+        file_path: Path to the uploaded audio or video file
+        decode: Callable returning the decoded samples, used on a cache miss
+
+    Returns:
+        Copy-on-write memory-mapped float32 array
+    """
+    cache_path = _cache_path(file_path)
+
+    if os.path.exists(cache_path):
+        try:
+            audio = np.load(cache_path, mmap_mode="c")
+            # Mark as recently used for size-based eviction
+            os.utime(cache_path)
+            _count(hit=True)
+            logger.info(f"Reusing decoded audio for: {file_path}")
+            return audio
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable audio cache entry {cache_path}: {str(e)}")
+
+    _count(hit=False)
+    audio = np.asarray(decode(), dtype=np.float32)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".npy.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, audio)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        # Caching is an optimisation; still return the decoded audio
+        logger.warning(f"Could not cache decoded audio: {str(e)}")
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        return audio
+
+    enforce_size_limit(keep=cache_path)
+    return np.load(cache_path, mmap_mode="c")
+
+def evict(file_path):
+    """Remove the cached audio of an upload. Call before deleting the upload itself."""
+    try:
+        os.unlink(_cache_path(file_path))
+        logger.info(f"Evicted decoded audio for: {file_path}")
+    except FileNotFoundError:
+        pass
+
+def _entries():
+    """Return (path, size, mtime) for every cache entry."""
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".npy"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((path, stat.st_size, stat.st_mtime))
+    return entries
+
+def enforce_size_limit(max_bytes=MAX_CACHE_BYTES, keep=None):
+    """Delete the least recently used entries until the cache fits in `max_bytes`."""
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            # Open memory maps stay valid after the file is unlinked
+            os.unlink(path)
+            total -= size
+            logger.info(f"Evicted decoded audio to stay under the cache limit: {path}")
+        except FileNotFoundError:
+            pass
+
+def get_stats():
+    """Return size accounting and hit counts for the cache."""
+    entries = _entries()
+    with _stats_lock:
+        return {
+            "entries": len(entries),
+            "total_bytes": sum(size for _, size, _ in entries),
+            "max_bytes": MAX_CACHE_BYTES,
+            "hits": _hits,
+            "misses": _misses,
+        }
@@ -0,0 +1,278 @@
+"""
+Headless batch transcriber for the subtitle generator app.
+This module walks directories of media files, transcribes them with several
+parallel worker processes and writes every subtitle format next to each
+source file.
+
+Progress is appended to a JSON-lines manifest (hash, model, status, timings),
+so an interrupted run can be restarted and skips work that already finished.
+
+Usage:
+    python batch_transcribe.py /media/archive --workers 4 --model small
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+# Same task choices as the web app
+TRANSCRIPTION_TASKS = {
+    "transcribe": ("transcribe",),
+    "translate": ("translate",),
+    "both": ("transcribe", "translate")
+}
+
+MANIFEST_FILENAME = "transcription_manifest.jsonl"
+
+def find_media_files(paths, extensions):
+    """Yield media files under the given files and directories in a stable order."""
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if '.' in name and name.rsplit('.', 1)[1].lower() in extensions:
+                    yield os.path.abspath(os.path.join(root, name))
+
+def find_stem_collisions(file_paths):
+    """Return the files that share their name without extension with another file in the same directory."""
+    stems = {}
+    for file_path in file_paths:
+        stems.setdefault(os.path.splitext(file_path)[0], []).append(file_path)
+    return {file_path for group in stems.values() if len(group) > 1 for file_path in group}
+
+def output_paths(file_path, results, formats, keep_extension=False):
+    """
+    Map each (task, format) to the subtitle file written next to the source.
+
+    With keep_extension the source extension stays in the name (clip.mp4.srt),
+    so clip.mp4 and clip.mp3 in one directory don't overwrite each other.
+    """
+    base_path = file_path if keep_extension else os.path.splitext(file_path)[0]
+    paths = {}
+    for task, result in results.items():
+        base = base_path
+        if len(results) > 1:
+            # Suffix the language so both tracks can sit side by side; the translation gets
+            # its own suffix so it doesn't collide with an English source track
+            base = f"{base_path}.{'en-translated' if task == 'translate' else result.get('language', task)}"
+        for subtitle_format in formats:
+            paths[(task, subtitle_format)] = f"{base}.{subtitle_format}"
+    return paths
+
+class Manifest:
+    """
+    Append-only JSON-lines record of every processed file.
+
+    The latest record for a path wins, so a resumed run simply appends.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A run killed mid-write can leave a partial last line
+                        continue
+                    self.records[record["path"]] = record
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, record):
+        self.records[record["path"]] = record
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+def is_finished(record, options, formats, file_hash=None, stat=None):
+    """Check whether a manifest record already covers this file with these options and formats."""
+    if not record or record.get("status") != "done":
+        return False
+    if any(record.get(key) != value for key, value in options.items()):
+        return False
+    if not set(formats) <= set(record.get("formats", [])):
+        return False
+    if not all(os.path.exists(path) for path in record.get("outputs", [])):
+        return False
+    if file_hash is not None:
+        return record.get("sha256") == file_hash
+    # Without a hash, trust an unchanged size and modification time
+    return stat is not None and record.get("size") == stat.st_size and record.get("mtime") == stat.st_mtime
+
+def _init_worker(workers):
+    """Give each worker process an equal share of the cores unless configured otherwise."""
+    import concurrency_governor
+
+    # No live streams here, so no slots are held back for them
+    max_jobs = None if os.environ.get("WHISPER_MAX_JOBS") else workers
+    concurrency_governor.governor = concurrency_governor.ConcurrencyGovernor(max_jobs=max_jobs, reserved_slots=0)
+
+def process_file(file_path, options, formats, previous, keep_extension=False):
+    """
+    Transcribe one file in a worker process and write its subtitles.
+
+    Returns:
+        The manifest record for the file
+    """
+    import job_store
+    import whisper_utils
+    import subtitle_formatter
+
+    stat = os.stat(file_path)
+    record = {
+        "path": file_path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "started_at": time.time(),
+        **options
+    }
+
+    try:
+        hash_start = time.monotonic()
+        record["sha256"] = job_store.hash_file(file_path)
+        record["hash_seconds"] = time.monotonic() - hash_start
+
+        if is_finished(previous, options, formats, file_hash=record["sha256"]):
+            # Touched but unchanged since the last run
+            record.update(status="done", formats=previous["formats"], outputs=previous["outputs"], skipped=True,
+                          finished_at=time.time())
+            return record
+
+        transcribe_start = time.monotonic()
+        results = whisper_utils.transcribe_multi_task(
+            file_path, options["model"], options["language"], TRANSCRIPTION_TASKS[options["task"]],
+            cache_audio=False,  # Each archive file is decoded only once
+            preset=options["preset"],
+            file_hash=record["sha256"]  # Don't read the file again for the checkpoint key
+        )
+        record["transcribe_seconds"] = time.monotonic() - transcribe_start
+
+        write_start = time.monotonic()
+        outputs = []
+        for (task, subtitle_format), path in output_paths(file_path, results, formats, keep_extension).items():
+            content, _ = subtitle_formatter.FORMATTERS[subtitle_format](results[task], "")
+            temp_path = f"{path}.partial"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+            outputs.append(path)
+        record["write_seconds"] = time.monotonic() - write_start
+
+        first = next(iter(results.values()))
+        segments = first.get("segments", [])
+        record.update(
+            status="done",
+            formats=list(formats),
+            outputs=outputs,
+            detected_language=first.get("language"),
+            audio_seconds=segments[-1]["end"] if segments else 0.0
+        )
+    except Exception as e:
+        record.update(status="failed", error=str(e))
+
+    record["finished_at"] = time.time()
+    return record
+
+def run_batch(paths, model_name="base", language=None, task="transcribe", formats=("srt", "vtt", "txt"),
+              workers=1, manifest_path=None, retry_failed=False, preset="standard"):
+    """
+    Transcribe every media file under `paths`, resuming from the manifest.
+
+    Returns:
+        Dictionary counting files per outcome
+    """
+    import whisper_utils
+
+    if not manifest_path:
+        first = os.path.abspath(paths[0])
+        manifest_path = os.path.join(first if os.path.isdir(first) else os.path.dirname(first), MANIFEST_FILENAME)
+    manifest = Manifest(manifest_path)
+    options = {"model": model_name, "language": language, "task": task, "preset": preset}
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+
+    file_paths = list(find_media_files(paths, whisper_utils.SUPPORTED_EXTENSIONS))
+    collisions = find_stem_collisions(file_paths)
+
+    pending = []
+    for file_path in file_paths:
+        previous = manifest.records.get(file_path)
+        if is_finished(previous, options, formats, stat=os.stat(file_path)):
+            counts["skipped"] += 1
+            continue
+        if not retry_failed and previous and previous.get("status") == "failed":
+            stat = os.stat(file_path)
+            unchanged = previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime
+            if unchanged and all(previous.get(key) == value for key, value in options.items()):
+                counts["skipped"] += 1
+                continue
+        pending.append((file_path, previous))
+
+    logger.info(f"{len(pending)} files to transcribe, {counts['skipped']} already handled (manifest: {manifest_path})")
+
+    start = time.monotonic()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(workers,)) as pool:
+            futures = {
+                pool.submit(process_file, file_path, options, list(formats), previous, file_path in collisions): file_path
+                for file_path, previous in pending
+            }
+            for index, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                manifest.append(record)
+                outcome = "skipped" if record.get("skipped") else record["status"]
+                counts[outcome] += 1
+                elapsed = time.monotonic() - start
+                logger.info(f"[{index}/{len(pending)}] {outcome}: {record['path']}"
+                            f" ({record.get('transcribe_seconds', 0):.1f}s, {index / elapsed * 60:.1f} files/min)")
+                if record["status"] == "failed":
+                    logger.error(f"Transcription failed for {record['path']}: {record['error']}")
+    finally:
+        manifest.close()
+
+    return counts
+
+def main(argv=None):
+    import decode_presets
+    import whisper_utils
+    import subtitle_formatter
+
+    parser = argparse.ArgumentParser(description="Transcribe media files in bulk and write subtitles next to them.")
+    parser.add_argument("paths", nargs="+", help="Media files or directories to walk")
+    parser.add_argument("--model", default="base", choices=list(whisper_utils.get_available_models()))
+    parser.add_argument("--language", default=None, help="Language code (auto-detected if omitted)")
+    parser.add_argument("--task", default="transcribe", choices=list(TRANSCRIPTION_TASKS))
+    parser.add_argument("--preset", default=decode_presets.DEFAULT_PRESET, choices=list(decode_presets.DECODE_PRESETS),
+                        help="Decoding speed preset")
+    parser.add_argument("--formats", default="srt,vtt,txt", help="Comma-separated subtitle formats to write")
+    parser.add_argument("--workers", type=int, default=1, help="Number of parallel worker processes")
+    parser.add_argument("--manifest", default=None, help=f"Manifest path (default: {MANIFEST_FILENAME} in the first directory)")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry files that failed in an earlier run")
+    args = parser.parse_args(argv)
+
+    formats = [subtitle_format.strip() for subtitle_format in args.formats.split(",") if subtitle_format.strip()]
+    unknown = [subtitle_format for subtitle_format in formats if subtitle_format not in subtitle_formatter.FORMATTERS]
+    if unknown:
+        parser.error(f"Unsupported subtitle formats: {', '.join(unknown)}")
+
+    counts = run_batch(args.paths, args.model, args.language, args.task, formats,
+                       args.workers, args.manifest, args.retry_failed, args.preset)
+    logger.info(f"Finished: {counts['done']} done, {counts['skipped']} skipped, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
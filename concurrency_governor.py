@@ -0,0 +1,272 @@
+"""
+CPU concurrency governor for the subtitle generator app.
+This module hands out thread budgets to inference jobs so that concurrent
+transcriptions running in different gunicorn workers share the host's cores
+instead of each one grabbing all of them.
+
+Capacity is tracked with one lock file per job slot, so every process on the
+host sees the same set of running jobs. Jobs beyond capacity wait for a slot.
+Every slot comes with an equal, fixed share of the cores, so the budgets of
+all running jobs never add up to more than the host has. Capacity defaults to
+one job per WHISPER_MIN_THREADS_PER_JOB cores, which keeps a lone job on a
+large host from being starved of threads.
+
+Some slots can be reserved for short latency-sensitive jobs (live stream
+windows), so they never queue behind long file transcriptions. None are
+reserved by default: on a host with room for only a few jobs, a reserved
+slot would sit idle most of the time while file jobs queue.
+"""
+import os
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Governor configuration (can be overridden with environment variables)
+SLOT_DIR = os.environ.get("WHISPER_GOVERNOR_DIR", os.path.join(tempfile.gettempdir(), "whisper_governor"))
+MIN_THREADS_PER_JOB = int(os.environ.get("WHISPER_MIN_THREADS_PER_JOB", "8"))
+RESERVED_SLOTS = int(os.environ.get("WHISPER_RESERVED_STREAM_SLOTS", "0"))
+POLL_INTERVAL = 0.25  # Seconds between attempts to grab a free slot
+
+def get_cpu_count():
+    """Return the number of cores this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+class ConcurrencyGovernor:
+    """
+    Limit the number of concurrent inference jobs on the host and give each
+    job a fixed share of the cores.
+    """
+
+    def __init__(self, cpu_count=None, max_jobs=None, slot_dir=SLOT_DIR, threads_per_job=None,
+                 reserved_slots=RESERVED_SLOTS):
+        self.cpu_count = cpu_count or get_cpu_count()
+        if max_jobs is None:
+            max_jobs = int(os.environ.get("WHISPER_MAX_JOBS", "0")) or self.cpu_count // MIN_THREADS_PER_JOB
+        self.max_jobs = max(1, min(max_jobs, self.cpu_count))
+        # Slots only reserved jobs may take; at least one slot stays open to everyone
+        self.reserved_slots = max(0, min(reserved_slots, self.max_jobs - 1))
+        # Budgets must add up to at most cpu_count (the benchmark baseline overrides this)
+        self.threads_per_job = threads_per_job or max(1, self.cpu_count // self.max_jobs)
+        self.slot_dir = slot_dir
+
+        # In-process counters for the stats endpoint
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._total_busy = 0.0
+        self._started_at = time.time()
+
+        os.makedirs(self.slot_dir, exist_ok=True)
+
+    def _slot_path(self, index):
+        return os.path.join(self.slot_dir, f"slot-{index}.lock")
+
+    @property
+    def shared_slots(self):
+        """Number of slots any job may take."""
+        return self.max_jobs - self.reserved_slots
+
+    def _try_acquire_slot(self, reserved=False):
+        """Try to lock any free slot. Returns an open file descriptor or None."""
+        # Reserved jobs try the reserved slots (the highest indices) first
+        indices = reversed(range(self.max_jobs)) if reserved else range(self.shared_slots)
+        for index in indices:
+            fd = os.open(self._slot_path(index), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def acquire(self, timeout=None, reserved=False):
+        """
+        Wait for a free job slot.
+
+        Args:
+            timeout: Maximum seconds to wait (None waits forever)
+            reserved: Also allow the slots reserved for latency-sensitive jobs
+
+        Returns:
+            The slot file descriptor, to be passed to release()
+        """
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                fd = self._try_acquire_slot(reserved)
+                if fd is not None:
+                    break
+                if timeout is not None and time.monotonic() - start >= timeout:
+                    raise TimeoutError(f"No inference slot became free within {timeout} seconds")
+                time.sleep(POLL_INTERVAL)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._active += 1
+            self._total_wait += waited
+        if waited > POLL_INTERVAL:
+            logger.info(f"Inference job waited {waited:.1f}s for a free slot")
+        return fd
+
+    def release(self, fd, busy_seconds=0.0):
+        """Release a slot obtained from acquire()."""
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._active -= 1
+            self._completed += 1
+            self._total_busy += busy_seconds
+
+    @contextmanager
+    def job(self, timeout=None, reserved=False):
+        """
+        Run an inference job inside a slot.
+
+        Yields:
+            The number of threads the job may use
+        """
+        fd = self.acquire(timeout=timeout, reserved=reserved)
+        start = time.monotonic()
+        try:
+            yield self.threads_per_job
+        finally:
+            self.release(fd, busy_seconds=time.monotonic() - start)
+
+    def count_active_slots(self):
+        """Count the slots currently held by any process on the host."""
+        held = 0
+        for index in range(self.max_jobs):
+            fd = os.open(self._slot_path(index), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except BlockingIOError:
+                held += 1
+            finally:
+                os.close(fd)
+        return held
+
+    def get_stats(self):
+        """Return utilization statistics for this host and process."""
+        host_active = self.count_active_slots()
+        with self._lock:
+            uptime = time.time() - self._started_at
+            return {
+                "cpu_count": self.cpu_count,
+                "max_jobs": self.max_jobs,
+                "reserved_slots": self.reserved_slots,
+                "threads_per_job": self.threads_per_job,
+                "host_active_jobs": host_active,
+                "host_utilization": host_active / self.max_jobs,
+                "process_active_jobs": self._active,
+                "process_waiting_jobs": self._waiting,
+                "process_completed_jobs": self._completed,
+                "process_avg_wait_seconds": self._total_wait / self._completed if self._completed else 0.0,
+                "process_busy_fraction": self._total_busy / uptime if uptime else 0.0,
+            }
+
+# Shared governor used by whisper_utils
+governor = ConcurrencyGovernor()
+
+def _benchmark_job(audio_path, model_name, governed):
+    """Run one benchmark job and return its duration in seconds."""
+    import torch
+
+    start = time.monotonic()
+    if audio_path:
+        import whisper_utils
+        if governed:
+            whisper_utils.transcribe_audio(audio_path, model_name)
+        else:
+            with _ungoverned():
+                whisper_utils.transcribe_audio(audio_path, model_name)
+    else:
+        # Synthetic CPU-bound workload roughly shaped like an encoder pass
+        def workload():
+            a = torch.randn(1024, 1024)
+            for _ in range(40):
+                a = torch.tanh(a @ a) * 0.5
+
+        if governed:
+            with governor.job() as threads:
+                torch.set_num_threads(threads)
+                workload()
+        else:
+            torch.set_num_threads(get_cpu_count())
+            workload()
+    return time.monotonic() - start
+
+@contextmanager
+def _ungoverned():
+    """Temporarily give every job all cores, as before the governor existed."""
+    import concurrency_governor as module
+
+    original = module.governor
+    module.governor = ConcurrencyGovernor(max_jobs=get_cpu_count(), slot_dir=tempfile.mkdtemp(),
+                                          threads_per_job=get_cpu_count(), reserved_slots=0)
+    try:
+        yield
+    finally:
+        module.governor = original
+
+def run_benchmark(levels=(1, 2, 4, 8), audio_path=None, model_name="tiny", governed=True):
+    """
+    Measure aggregate throughput with several concurrent jobs.
+
+    Each level starts that many worker processes at once, mirroring separate
+    gunicorn workers, and runs one job in each.
+
+    Returns:
+        List of dictionaries with concurrency, wall time and jobs per minute
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = []
+    for level in levels:
+        with ProcessPoolExecutor(max_workers=level) as pool:
+            start = time.monotonic()
+            futures = [pool.submit(_benchmark_job, audio_path, model_name, governed) for _ in range(level)]
+            durations = [future.result() for future in futures]
+            wall = time.monotonic() - start
+        results.append({
+            "concurrency": level,
+            "wall_seconds": wall,
+            "avg_job_seconds": sum(durations) / len(durations),
+            "jobs_per_minute": level / wall * 60,
+        })
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark transcription throughput at several concurrency levels.")
+    parser.add_argument("audio", nargs="?", help="Audio file to transcribe (a synthetic workload is used if omitted)")
+    parser.add_argument("--model", default="tiny", help="Whisper model to use with an audio file")
+    parser.add_argument("--levels", default="1,2,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--ungoverned", action="store_true", help="Let every job use all cores for comparison")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(",")]
+    print(f"cores={governor.cpu_count} max_jobs={governor.max_jobs} threads_per_job={governor.threads_per_job}"
+          f" governed={not args.ungoverned}")
+    print(f"{'jobs':>5} {'wall s':>9} {'avg job s':>10} {'jobs/min':>9}")
+    for row in run_benchmark(levels, args.audio, args.model, governed=not args.ungoverned):
+        print(f"{row['concurrency']:>5} {row['wall_seconds']:>9.2f} {row['avg_job_seconds']:>10.2f} {row['jobs_per_minute']:>9.2f}")
@@ -0,0 +1,209 @@
+"""
+Decoding speed presets and runaway-repetition guard for Whisper.
+This module maps named speed/quality presets to model.transcribe options and
+provides a guard that stops Whisper from burning minutes re-decoding windows
+of music or silence that only produce repetition loops. The guard changes
+which windows end up in the output, so it is opt-in per preset; "standard"
+decodes exactly as Whisper does.
+"""
+import math
+import time
+import logging
+import threading
+import dataclasses
+from collections import deque
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Options shared by every preset
+_THRESHOLDS = {
+    "compression_ratio_threshold": 2.4,
+    "logprob_threshold": -1.0,
+    "no_speech_threshold": 0.6
+}
+
+# Named presets, fastest first
+DECODE_PRESETS = {
+    "greedy-fast": {
+        "beam_size": None,
+        "best_of": None,
+        "temperature": (0.0,),
+        "condition_on_previous_text": False,
+        **_THRESHOLDS
+    },
+    "balanced": {
+        "beam_size": None,
+        "best_of": 3,
+        "temperature": (0.0, 0.2, 0.4, 0.6),
+        "condition_on_previous_text": False,
+        **_THRESHOLDS
+    },
+    # What model.transcribe does when given no options, as the app did before presets
+    "standard": {
+        "beam_size": None,
+        "best_of": None,
+        "temperature": (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        "condition_on_previous_text": True,
+        **_THRESHOLDS
+    },
+    "beam-accurate": {
+        "beam_size": 5,
+        "best_of": 5,
+        "temperature": (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        "condition_on_previous_text": True,
+        **_THRESHOLDS
+    }
+}
+
+DEFAULT_PRESET = "standard"
+
+# Presets that run the repetition guard, which skips windows stuck in loops
+REPETITION_GUARD_PRESETS = {"greedy-fast", "balanced", "beam-accurate"}
+
+# Descriptions shown in the web UI
+PRESET_DESCRIPTIONS = {
+    "greedy-fast": "Fast (greedy decoding, no retries, skips repetition loops)",
+    "balanced": "Balanced (fewer sampling retries on failure, skips repetition loops)",
+    "standard": "Standard (Whisper defaults, no repetition guard)",
+    "beam-accurate": "Accurate (beam search, full retries, skips repetition loops)"
+}
+
+# Decoding attempts allowed on a repetitive window before the guard skips it
+MAX_REPETITIVE_ATTEMPTS = 2
+
+# Number of previous windows compared against for cross-window loops
+REPEAT_HISTORY = 3
+
+_totals_lock = threading.Lock()
+_totals = {
+    "windows_decoded": 0,
+    "windows_skipped": 0,
+    "decodes_avoided": 0,
+    "decode_seconds": 0.0,
+    "estimated_seconds_saved": 0.0
+}
+
+def get_decode_options(preset):
+    """
+    Return model.transcribe options for a preset.
+
+    Raises:
+        ValueError: If the preset does not exist
+    """
+    if preset not in DECODE_PRESETS:
+        raise ValueError(f"Unknown decoding preset: {preset}")
+    return dict(DECODE_PRESETS[preset])
+
+class RepetitionGuard:
+    """
+    Watch every window Whisper decodes during one job and skip the ones stuck in
+    repetition, instead of letting the temperature fallback retry them.
+
+    A window is skipped when it is still too repetitive (compression ratio over
+    the threshold) after MAX_REPETITIVE_ATTEMPTS attempts (or after the last
+    temperature, for presets with fewer), or when it repeats
+    the text of each of the previous REPEAT_HISTORY windows. Skipped windows are
+    reported to Whisper as silence, so it moves on to the next window.
+    """
+
+    def __init__(self, temperatures, compression_ratio_threshold=_THRESHOLDS["compression_ratio_threshold"],
+                 logprob_threshold=_THRESHOLDS["logprob_threshold"]):
+        self.temperatures = tuple(temperatures) if isinstance(temperatures, (list, tuple)) else (temperatures,)
+        self.max_attempts = min(MAX_REPETITIVE_ATTEMPTS, len(self.temperatures))
+        self.compression_ratio_threshold = compression_ratio_threshold
+        self.logprob_threshold = logprob_threshold
+        self.recent_texts = deque(maxlen=REPEAT_HISTORY)
+
+        self._window = None
+        self._window_text = None
+        self._attempts = 0
+        self.windows_decoded = 0
+        self.windows_skipped = 0
+        self.decodes_avoided = 0
+        self.decode_calls = 0
+        self.decode_seconds = 0.0
+
+    def _skip(self, result, reason):
+        # Only count the retries Whisper's own fallback would have made
+        would_retry = (result.compression_ratio > self.compression_ratio_threshold
+                       or (self.logprob_threshold is not None and result.avg_logprob < self.logprob_threshold))
+        remaining = len(self.temperatures) - self._attempts
+        self.windows_skipped += 1
+        if would_retry:
+            self.decodes_avoided += max(0, remaining)
+        logger.info(f"Skipping window after {self._attempts} attempts: {reason}")
+        return dataclasses.replace(
+            result,
+            tokens=[],
+            text="",
+            avg_logprob=-math.inf,
+            no_speech_prob=1.0,
+            compression_ratio=0.0
+        )
+
+    def decode(self, decode, mel, options):
+        """Run one decoding attempt through the guard."""
+        # The fallback loop retries the same mel tensor with increasing temperature
+        if mel is not self._window:
+            if self._window_text is not None:
+                self.recent_texts.append(self._window_text)
+            self._window = mel
+            self._window_text = None
+            self._attempts = 0
+            self.windows_decoded += 1
+
+        start = time.monotonic()
+        result = decode(mel, options)
+        self.decode_seconds += time.monotonic() - start
+        self.decode_calls += 1
+        self._attempts += 1
+
+        if isinstance(result, list):
+            # Batched decoding is not used by transcribe; leave it alone
+            return result
+
+        text = result.text.strip().lower()
+        if text and len(self.recent_texts) == REPEAT_HISTORY and all(text == recent for recent in self.recent_texts):
+            return self._skip(result, "same text as the previous windows")
+
+        if result.compression_ratio > self.compression_ratio_threshold and self._attempts >= self.max_attempts:
+            return self._skip(result, f"compression ratio {result.compression_ratio:.1f}")
+
+        self._window_text = text
+        return result
+
+    def get_history(self):
+        """Return the recent window texts, to be saved with a checkpoint."""
+        history = list(self.recent_texts)
+        if self._window_text is not None:
+            history.append(self._window_text)
+        return history[-REPEAT_HISTORY:]
+
+    def restore_history(self, history):
+        """Continue from window texts saved by get_history()."""
+        self.recent_texts = deque(history, maxlen=REPEAT_HISTORY)
+        self._window = None
+        self._window_text = None
+
+    def get_stats(self):
+        """Return counters for this job, including decode time saved."""
+        average = self.decode_seconds / self.decode_calls if self.decode_calls else 0.0
+        return {
+            "windows_decoded": self.windows_decoded,
+            "windows_skipped": self.windows_skipped,
+            "decodes_avoided": self.decodes_avoided,
+            "decode_seconds": self.decode_seconds,
+            "estimated_seconds_saved": self.decodes_avoided * average
+        }
+
+def record_job_stats(stats):
+    """Add one job's guard counters to the process totals."""
+    with _totals_lock:
+        for key, value in stats.items():
+            _totals[key] += value
+
+def get_stats():
+    """Return guard counters accumulated over all jobs in this process."""
+    with _totals_lock:
+        return dict(_totals)
@@ -0,0 +1,284 @@
+"""
+Admission control and fair-share scheduling for transcription jobs.
+This module sits in front of whisper_utils so that one client submitting a
+long file with a large model cannot hold all inference capacity while short
+clips from other clients wait behind it.
+
+Jobs are ordered by priority class first and then by start-time fair queuing
+across clients, using a cost estimate of audio duration x model factor. When
+the estimated wait for a new job exceeds the limit, or the queue is already
+full, it is rejected with a retry hint instead of being queued. Every queued
+job holds a server thread while it waits, so the queue depth must stay below
+the number of threads the server has.
+
+The scheduler works inside one worker process, so the app should run with a
+single gunicorn worker and several threads (see .replit).
+"""
+import os
+import math
+import time
+import logging
+import threading
+import itertools
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+PRIORITY_CLASSES = {
+    "interactive": 0,
+    "normal": 1,
+    "batch": 2
+}
+
+# Relative decoding cost per second of audio for each Whisper model
+MODEL_COST_FACTORS = {
+    "tiny": 1.0,
+    "base": 2.0,
+    "small": 6.0,
+    "medium": 15.0,
+    "large": 30.0
+}
+
+# Scheduler configuration (can be overridden with environment variables)
+MAX_WAIT_SECONDS = float(os.environ.get("WHISPER_MAX_QUEUE_WAIT", "600"))
+INITIAL_SECONDS_PER_COST = float(os.environ.get("WHISPER_SECONDS_PER_COST", "0.1"))
+RATE_SMOOTHING = 0.2  # Weight of the newest observation in the processing rate estimate
+
+class SchedulerBusy(Exception):
+    """Raised when a job would wait longer than the admission limit or the queue is full."""
+
+    def __init__(self, estimated_wait, retry_after, reason=None):
+        super().__init__(reason or f"Estimated wait of {estimated_wait:.0f}s exceeds the limit")
+        self.estimated_wait = estimated_wait
+        self.retry_after = retry_after
+
+def estimate_cost(duration, model_name, task_count=1):
+    """
+    Estimate the cost of a job in model-weighted seconds of audio.
+
+    Args:
+        duration: Audio duration in seconds
+        model_name: Whisper model to use
+        task_count: Number of decoding tasks run over the audio
+
+    Returns:
+        The estimated cost
+    """
+    return duration * MODEL_COST_FACTORS.get(model_name, MODEL_COST_FACTORS["large"]) * task_count
+
+class _Ticket:
+    def __init__(self, seq, client_id, priority, cost, start_tag):
+        self.seq = seq
+        self.client_id = client_id
+        self.priority = priority
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = start_tag + cost
+        self.started_at = None
+
+    def sort_key(self):
+        return (PRIORITY_CLASSES[self.priority], self.start_tag, self.seq)
+
+class FairScheduler:
+    """
+    Fair-share scheduler that runs at most `capacity` jobs at once.
+    """
+
+    def __init__(self, capacity, max_wait=MAX_WAIT_SECONDS, seconds_per_cost=INITIAL_SECONDS_PER_COST, max_queued=None):
+        self.capacity = max(1, capacity)
+        self.max_wait = max_wait
+        self.max_queued = max_queued  # None queues without limit
+        self.seconds_per_cost = seconds_per_cost
+
+        self._condition = threading.Condition()
+        self._seq = itertools.count()
+        self._queue = []
+        self._running = []
+        self._virtual_time = 0.0
+        self._client_finish = {}
+
+        # Counters for the stats endpoint
+        self._admitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._client_completed_cost = {}
+
+    def _estimate_wait(self, ticket):
+        """Estimate seconds until `ticket` starts, assuming it is queued now."""
+        now = time.monotonic()
+        remaining_running = 0.0
+        for running in self._running:
+            elapsed_cost = (now - running.started_at) / self.seconds_per_cost
+            remaining_running += max(0.0, running.cost - elapsed_cost)
+
+        queued_ahead = sum(queued.cost for queued in self._queue if queued.sort_key() < ticket.sort_key())
+
+        # Nothing to wait for while a slot is free and no one is ahead
+        if len(self._running) < self.capacity and queued_ahead == 0:
+            return 0.0
+        return (remaining_running + queued_ahead) * self.seconds_per_cost / self.capacity
+
+    def _is_next(self, ticket):
+        return len(self._running) < self.capacity and min(self._queue, key=_Ticket.sort_key) is ticket
+
+    def run(self, client_id, cost, fn, priority="normal"):
+        """
+        Admit a job, wait for its turn and run it.
+
+        Args:
+            client_id: Session or API key the job is accounted to
+            cost: Estimated cost from estimate_cost()
+            fn: Callable that performs the work
+            priority: One of PRIORITY_CLASSES
+
+        Returns:
+            Whatever fn returns
+
+        Raises:
+            SchedulerBusy: If the estimated wait exceeds the admission limit or the queue is full
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        with self._condition:
+            start_tag = max(self._virtual_time, self._client_finish.get(client_id, 0.0))
+            ticket = _Ticket(next(self._seq), client_id, priority, cost, start_tag)
+
+            estimated_wait = self._estimate_wait(ticket)
+            if estimated_wait > self.max_wait:
+                self._rejected += 1
+                retry_after = max(1, math.ceil(estimated_wait - self.max_wait))
+                logger.info(f"Rejected job from {client_id}: estimated wait {estimated_wait:.0f}s")
+                raise SchedulerBusy(estimated_wait, retry_after)
+
+            if self.max_queued is not None and estimated_wait > 0 and len(self._queue) >= self.max_queued:
+                self._rejected += 1
+                # Try again about when the job at the head of the queue has started
+                head = min(self._queue, key=_Ticket.sort_key, default=None)
+                head_wait = self._estimate_wait(head) if head else estimated_wait
+                retry_after = max(1, math.ceil(head_wait))
+                logger.info(f"Rejected job from {client_id}: {len(self._queue)} jobs already queued")
+                raise SchedulerBusy(estimated_wait, retry_after, reason=f"{len(self._queue)} jobs already queued")
+
+            self._admitted += 1
+            self._client_finish[client_id] = ticket.finish_tag
+            self._queue.append(ticket)
+            logger.info(f"Queued job from {client_id} (cost {cost:.0f}, priority {priority},"
+                        f" estimated wait {estimated_wait:.0f}s)")
+
+            while not self._is_next(ticket):
+                self._condition.wait()
+
+            self._queue.remove(ticket)
+            self._running.append(ticket)
+            self._virtual_time = ticket.start_tag
+            ticket.started_at = time.monotonic()
+            # Another slot may still be free for the next job in line
+            self._condition.notify_all()
+
+        try:
+            return fn()
+        finally:
+            elapsed = time.monotonic() - ticket.started_at
+            with self._condition:
+                self._running.remove(ticket)
+                self._completed += 1
+                self._client_completed_cost[client_id] = self._client_completed_cost.get(client_id, 0.0) + cost
+                if cost > 0:
+                    observed = elapsed / cost
+                    self.seconds_per_cost += RATE_SMOOTHING * (observed - self.seconds_per_cost)
+                if not self._queue and not self._running:
+                    # Idle: forget old virtual finish times so returning clients start fresh
+                    self._client_finish.clear()
+                self._condition.notify_all()
+
+    def get_stats(self):
+        """Return queue and fairness statistics for this process."""
+        with self._condition:
+            queued_by_class = {name: 0 for name in PRIORITY_CLASSES}
+            for ticket in self._queue:
+                queued_by_class[ticket.priority] += 1
+            return {
+                "capacity": self.capacity,
+                "running_jobs": len(self._running),
+                "queued_jobs": len(self._queue),
+                "queued_by_priority": queued_by_class,
+                "queued_cost": sum(ticket.cost for ticket in self._queue),
+                "seconds_per_cost": self.seconds_per_cost,
+                "max_wait_seconds": self.max_wait,
+                "max_queued_jobs": self.max_queued,
+                "admitted_jobs": self._admitted,
+                "rejected_jobs": self._rejected,
+                "completed_jobs": self._completed,
+                "completed_cost_by_client": dict(self._client_completed_cost),
+            }
+
+def _stub_transcribe(duration, model_name, seconds_per_cost):
+    """Stand-in for a Whisper model that sleeps in proportion to the audio duration."""
+    time.sleep(estimate_cost(duration, model_name) * seconds_per_cost)
+    return {"text": "", "segments": [], "duration": duration}
+
+def simulate(jobs, capacity=2, max_wait=MAX_WAIT_SECONDS, seconds_per_cost=0.001, max_queued=None):
+    """
+    Run jobs through a scheduler backed by the sleeping stub model.
+
+    Args:
+        jobs: List of (client_id, duration, model_name, priority) tuples, submitted in order
+        capacity: Number of jobs that may run at once
+        max_wait: Admission limit in seconds
+        seconds_per_cost: Stub processing speed
+        max_queued: Queue depth limit (None for no limit)
+
+    Returns:
+        List of (client_id, duration, status, seconds_until_done) in completion order
+    """
+    scheduler = FairScheduler(capacity, max_wait=max_wait, seconds_per_cost=seconds_per_cost, max_queued=max_queued)
+    finished = []
+    finished_lock = threading.Lock()
+    start = time.monotonic()
+
+    def submit(client_id, duration, model_name, priority):
+        cost = estimate_cost(duration, model_name)
+        try:
+            scheduler.run(client_id, cost, lambda: _stub_transcribe(duration, model_name, seconds_per_cost), priority)
+            status = "done"
+        except SchedulerBusy as e:
+            status = f"429 (retry after {e.retry_after}s)"
+        with finished_lock:
+            finished.append((client_id, duration, status, time.monotonic() - start))
+
+    threads = []
+    for job in jobs:
+        thread = threading.Thread(target=submit, args=job)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)  # Keep submission order deterministic
+    for thread in threads:
+        thread.join()
+    return finished
+
+if __name__ == "__main__":
+    scenarios = []
+
+    # One client submits a 3-hour file with `large` while others send short clips
+    jobs = [("archive", 3 * 3600, "large", "batch")]
+    jobs += [(f"user-{i % 3}", 60, "base", "normal") for i in range(6)]
+    jobs += [("archive", 3 * 3600, "large", "batch")]
+    scenarios.append(("Fair share: short clips overtake a long batch job", jobs, 2, None))
+
+    # A single slot is busy with a long file, so the next job would wait past the
+    # limit and is rejected with a retry hint
+    jobs = [("archive", 3 * 3600, "large", "batch"), ("other", 3 * 3600, "large", "normal")]
+    scenarios.append(("Admission control: a job that would wait too long gets a 429", jobs, 1, None))
+
+    # Short clips that fit the wait limit, but only two may hold a server thread in the queue
+    jobs = [(f"user-{i}", 3600, "base", "normal") for i in range(5)]
+    scenarios.append(("Queue depth: jobs beyond the queue limit get a 429", jobs, 1, 2))
+
+    for title, jobs, capacity, max_queued in scenarios:
+        print(title)
+        for client_id, duration, status, seconds in simulate(jobs, capacity=capacity, max_wait=2, seconds_per_cost=1e-5,
+                                                             max_queued=max_queued):
+            print(f"{seconds:8.2f}s  {client_id:<8} {duration:>6}s  {status}")
+        print()
@@ -0,0 +1,96 @@
+"""
+Job store for the subtitle generator app.
+This module persists transcription checkpoints as JSON files on local disk so
+that a job interrupted by a killed or timed-out worker can be resumed by the
+next worker that picks it up.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Store configuration (can be overridden with environment variables)
+JOB_STORE_DIR = os.environ.get("WHISPER_JOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "whisper_jobs"))
+CHECKPOINT_MAX_AGE = int(os.environ.get("WHISPER_CHECKPOINT_MAX_AGE", str(24 * 3600)))
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_job_key(file_hash, **options):
+    """
+    Build a stable key for a job from the media content and decoding options.
+
+    Args:
+        file_hash: SHA-256 of the media file
+        options: Decoding options that affect the output (model, task, language, ...)
+
+    Returns:
+        A hex string usable as a file name
+    """
+    payload = json.dumps({"file": file_hash, **options}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _checkpoint_path(job_key):
+    return os.path.join(JOB_STORE_DIR, f"{job_key}.json")
+
+def load_checkpoint(job_key):
+    """
+    Load the last checkpoint saved for a job.
+
+    Returns:
+        The checkpoint dictionary, or None if there is no usable checkpoint
+    """
+    try:
+        with open(_checkpoint_path(job_key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable checkpoint {job_key}: {str(e)}")
+        return None
+
+def save_checkpoint(job_key, checkpoint):
+    """Atomically replace the checkpoint for a job."""
+    os.makedirs(JOB_STORE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=JOB_STORE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({**checkpoint, "saved_at": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, _checkpoint_path(job_key))
+    except Exception:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def delete_checkpoint(job_key):
+    """Remove the checkpoint for a finished job."""
+    try:
+        os.unlink(_checkpoint_path(job_key))
+    except FileNotFoundError:
+        pass
+
+def purge_stale_checkpoints(max_age=CHECKPOINT_MAX_AGE):
+    """Delete checkpoints of jobs that were abandoned and never resumed."""
+    if not os.path.isdir(JOB_STORE_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(JOB_STORE_DIR):
+        path = os.path.join(JOB_STORE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+                logger.info(f"Purged stale checkpoint: {name}")
+        except OSError:
+            pass
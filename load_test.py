@@ -0,0 +1,217 @@
+"""
+Load generator for the subtitle generator web app.
+This module runs concurrent upload/transcribe/download sessions against the
+app and reports throughput, latency percentiles and error rates per endpoint.
+
+With --spawn it starts the app under gunicorn using the deterministic stub
+Whisper backend, so only the web tier is measured.
+
+Usage:
+    python load_test.py --spawn --sessions 200 --concurrency 16
+    python load_test.py --url http://127.0.0.1:5000 --sessions 50
+"""
+import io
+import os
+import sys
+import math
+import time
+import wave
+import socket
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ENDPOINTS = ("/upload", "/transcribe", "/download")
+
+def make_wav(duration, sample_rate=16000):
+    """Build an in-memory 16-bit mono WAV file with a quiet test tone."""
+    frames = bytearray()
+    for i in range(int(duration * sample_rate)):
+        sample = int(3000 * math.sin(2 * math.pi * 440 * i / sample_rate))
+        frames += sample.to_bytes(2, "little", signed=True)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class Recorder:
+    """Collect per-endpoint latencies and errors from many threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: {} for endpoint in ENDPOINTS}
+
+    def record(self, endpoint, seconds, error=None):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if error:
+                self.errors[endpoint][error] = self.errors[endpoint].get(error, 0) + 1
+
+def run_session(base_url, wav_bytes, model_name, subtitle_format, recorder):
+    """
+    Run one user session: upload, transcribe, download.
+
+    Returns:
+        True if every step succeeded
+    """
+    http = requests.Session()
+    steps = (
+        ("/upload", {"files": {"file": ("load-test.wav", wav_bytes, "audio/wav")}}),
+        ("/transcribe", {"data": {"model": model_name, "task": "transcribe", "language": "en"}}),
+        ("/download", {"data": {"format": subtitle_format}}),
+    )
+
+    for endpoint, kwargs in steps:
+        start = time.monotonic()
+        error = None
+        try:
+            response = http.post(base_url + endpoint, timeout=600, **kwargs)
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        recorder.record(endpoint, time.monotonic() - start, error)
+        if error:
+            return False
+
+    # Free the upload on the server like the web UI does
+    try:
+        http.post(base_url + "/clear", timeout=30)
+    except requests.RequestException:
+        pass
+    return True
+
+def run_load(base_url, sessions, concurrency, audio_seconds=30, model_name="tiny", subtitle_format="srt"):
+    """
+    Run `sessions` sessions with at most `concurrency` in flight.
+
+    Returns:
+        Dictionary with the overall wall time and per-endpoint statistics
+    """
+    wav_bytes = make_wav(audio_seconds)
+    recorder = Recorder()
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(
+            lambda _: run_session(base_url, wav_bytes, model_name, subtitle_format, recorder),
+            range(sessions)
+        ))
+    wall = time.monotonic() - start
+
+    report = {
+        "wall_seconds": wall,
+        "sessions": sessions,
+        "successful_sessions": sum(outcomes),
+        "sessions_per_second": sum(outcomes) / wall if wall else 0.0,
+        "endpoints": {}
+    }
+    for endpoint in ENDPOINTS:
+        latencies = recorder.latencies[endpoint]
+        error_count = sum(recorder.errors[endpoint].values())
+        report["endpoints"][endpoint] = {
+            "requests": len(latencies),
+            "requests_per_second": len(latencies) / wall if wall else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "error_rate": error_count / len(latencies) if latencies else 0.0,
+            "errors": recorder.errors[endpoint]
+        }
+    return report
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def spawn_app(workers=1, threads=8, port=None, extra_env=None):
+    """
+    Start the app under gunicorn with the stub Whisper backend.
+
+    Returns:
+        Tuple of (process, base_url)
+    """
+    port = port or _free_port()
+    env = {**os.environ, "WHISPER_BACKEND": "stub", **(extra_env or {})}
+    cmd = [
+        "gunicorn", "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers), "--threads", str(threads),
+        "--log-level", "warning",
+        "main:app"
+    ]
+    process = subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    base_url = f"http://127.0.0.1:{port}"
+
+    # Wait for the app to accept requests
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            requests.get(base_url + "/stats", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start within 60 seconds")
+
+def print_report(report):
+    print(f"{report['successful_sessions']}/{report['sessions']} sessions succeeded in"
+          f" {report['wall_seconds']:.1f}s ({report['sessions_per_second']:.2f} sessions/s)")
+    print(f"{'endpoint':<12} {'reqs':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"{endpoint:<12} {stats['requests']:>6} {stats['requests_per_second']:>7.2f}"
+              f" {stats['p50'] * 1000:>8.0f} {stats['p95'] * 1000:>8.0f} {stats['p99'] * 1000:>8.0f}"
+              f" {stats['error_rate']:>6.1%}")
+        for error, count in stats["errors"].items():
+            print(f"{'':<12} {count} x {error}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the subtitle generator web app.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base URL of a running app")
+    parser.add_argument("--spawn", action="store_true", help="Start the app under gunicorn with the stub backend")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers when spawning")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker when spawning")
+    parser.add_argument("--stub-latency", type=float, default=None, help="STUB_WHISPER_LATENCY for the spawned app")
+    parser.add_argument("--sessions", type=int, default=50, help="Total number of sessions")
+    parser.add_argument("--concurrency", type=int, default=8, help="Sessions in flight at once")
+    parser.add_argument("--audio-seconds", type=float, default=30, help="Length of the uploaded test audio")
+    parser.add_argument("--model", default="tiny", help="Model requested from /transcribe")
+    parser.add_argument("--format", default="srt", help="Subtitle format requested from /download")
+    args = parser.parse_args(argv)
+
+    process = None
+    base_url = args.url
+    if args.spawn:
+        extra_env = {}
+        if args.stub_latency is not None:
+            extra_env["STUB_WHISPER_LATENCY"] = str(args.stub_latency)
+        process, base_url = spawn_app(args.workers, args.threads, extra_env=extra_env)
+
+    try:
+        report = run_load(base_url, args.sessions, args.concurrency, args.audio_seconds, args.model, args.format)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    print_report(report)
+    return 0 if report["successful_sessions"] == report["sessions"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Kill-and-resume check for checkpointed transcriptions.
+This module transcribes a long file once without interruption, then again in
+a worker process that is killed right after its first checkpoint and
+restarted, and checks that the resumed run produces the same segments.
+
+It uses the deterministic stub Whisper backend by default, so it runs
+without model downloads; pass --backend whisper to check a real model. The
+stub conditions each window on the text before it and often repeats itself,
+so the resumed output only matches if the checkpoint carried the decoder
+prompt and the repetition guard's history across the restart.
+
+Usage:
+    python -m pytest resume_test.py
+    python resume_test.py
+    python resume_test.py --seconds 1200 --chunk-seconds 300 --backend whisper --model tiny
+"""
+import os
+import sys
+import json
+import math
+import time
+import wave
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+
+def write_wav(path, duration, sample_rate=16000):
+    """Write a 16-bit mono WAV file with a quiet 400 Hz test tone."""
+    period = bytearray()
+    for i in range(sample_rate // 400):
+        sample = int(3000 * math.sin(2 * math.pi * i * 400 / sample_rate))
+        period += sample.to_bytes(2, "little", signed=True)
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        second = bytes(period) * 400
+        for _ in range(int(duration)):
+            wav.writeframes(second)
+
+def worker_env(args, work_dir, store_name):
+    """Environment for a worker process with its own job store."""
+    return {
+        **os.environ,
+        "WHISPER_BACKEND": args.backend,
+        "WHISPER_JOB_STORE_DIR": os.path.join(work_dir, store_name),
+        "WHISPER_GOVERNOR_DIR": os.path.join(work_dir, f"{store_name}-slots"),
+        "WHISPER_CHECKPOINT_MIN_SECONDS": str(args.chunk_seconds),
+        "WHISPER_CHECKPOINT_CHUNK_SECONDS": str(args.chunk_seconds),
+        "STUB_WHISPER_LATENCY": str(args.chunk_latency),
+        "STUB_WHISPER_REPEAT_RATE": str(args.repeat_rate)
+    }
+
+def start_worker(args, work_dir, store_name, audio_path, output_path):
+    """Start a worker process that transcribes `audio_path` into `output_path`."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", audio_path, output_path,
+           "--model", args.model, "--language", args.language, "--preset", args.preset]
+    return subprocess.Popen(cmd, env=worker_env(args, work_dir, store_name))
+
+def run_worker(audio_path, output_path, model_name, language, preset):
+    """Transcribe a file with checkpointing and write its segments as JSON."""
+    import whisper_utils
+
+    result = whisper_utils.transcribe_multi_task(audio_path, model_name, language, ("transcribe",), cache_audio=False,
+                                                 preset=preset)
+    result = result["transcribe"]
+    segments = [
+        {"start": round(segment["start"], 3), "end": round(segment["end"], 3), "text": segment["text"]}
+        for segment in result["segments"]
+    ]
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(segments, f)
+
+def wait_for_checkpoint(store_dir, process, timeout):
+    """Wait until a checkpoint file appears. Returns its path, or None if the worker exited first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        if os.path.isdir(store_dir):
+            checkpoints = [name for name in os.listdir(store_dir) if name.endswith(".json")]
+            if checkpoints:
+                return os.path.join(store_dir, checkpoints[0])
+        time.sleep(0.05)
+    return None
+
+def run_resume(args, work_dir):
+    """
+    Transcribe once without interruption and once with a kill after the first checkpoint.
+
+    Returns:
+        Tuple of (reference segments, resumed segments, checkpoint the resumed run restarted from)
+
+    Raises:
+        RuntimeError: If a worker fails or finishes before saving a checkpoint
+    """
+    audio_path = os.path.join(work_dir, "long.wav")
+    write_wav(audio_path, args.seconds)
+
+    # Uninterrupted reference run
+    reference_path = os.path.join(work_dir, "reference.json")
+    if start_worker(args, work_dir, "reference", audio_path, reference_path).wait() != 0:
+        raise RuntimeError("Reference run failed")
+
+    # Run again, kill the worker after its first checkpoint, then resume
+    resumed_path = os.path.join(work_dir, "resumed.json")
+    process = start_worker(args, work_dir, "resumed", audio_path, resumed_path)
+    checkpoint_path = wait_for_checkpoint(os.path.join(work_dir, "resumed"), process, args.timeout)
+    if not checkpoint_path:
+        process.kill()
+        raise RuntimeError("The worker finished or timed out before saving a checkpoint; use longer audio or smaller chunks")
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+
+    if start_worker(args, work_dir, "resumed", audio_path, resumed_path).wait() != 0:
+        raise RuntimeError("Resumed run failed")
+
+    with open(reference_path, "r", encoding="utf-8") as f:
+        reference = json.load(f)
+    with open(resumed_path, "r", encoding="utf-8") as f:
+        resumed = json.load(f)
+    return reference, resumed, checkpoint
+
+def run_check(args):
+    """
+    Compare an uninterrupted run with a killed-and-resumed one.
+
+    Returns:
+        True if the resumed output matches
+    """
+    try:
+        reference, resumed, checkpoint = run_resume(args, tempfile.mkdtemp(prefix="resume_test_"))
+    except RuntimeError as e:
+        print(e)
+        return False
+    print(f"Killed the worker after a checkpoint at {checkpoint['offset'] / 16000:.1f}s")
+
+    if resumed != reference:
+        for index, (expected, actual) in enumerate(zip(reference, resumed)):
+            if expected != actual:
+                print(f"First difference at segment {index}:\n  expected {expected}\n  actual   {actual}")
+                break
+        print(f"FAIL: {len(reference)} reference segments, {len(resumed)} resumed segments")
+        return False
+
+    print(f"OK: resumed output matches the uninterrupted run ({len(reference)} segments)")
+    return True
+
+def test_resume_matches_uninterrupted_run(tmp_path):
+    """A killed stub job resumes with its prompt and repetition guard history and gives identical output."""
+    import pytest
+
+    for module in ("numpy", "torch", "whisper"):
+        pytest.importorskip(module)
+    if not shutil.which("ffmpeg"):
+        pytest.skip("ffmpeg is needed to decode the test audio")
+    import decode_presets
+
+    args = parser.parse_args(["--seconds", "240", "--chunk-seconds", "44", "--chunk-latency", "0.2"])
+    reference, resumed, checkpoint = run_resume(args, str(tmp_path))
+
+    # The checkpoint carries the decoder context of the segments before it
+    text_so_far = "".join(segment["text"] for segment in checkpoint["segments"])
+    assert checkpoint["prompt"] and text_so_far.endswith(checkpoint["prompt"])
+
+    # It was taken in the middle of a repetition loop that the guard cuts at the first window after it,
+    # which a guard starting with an empty history would let through
+    history = checkpoint["guard_history"]
+    assert len(history) == decode_presets.REPEAT_HISTORY and len(set(history)) == 1
+    resume_seconds = checkpoint["offset"] / 16000
+    assert not any(segment["start"] == resume_seconds for segment in reference)
+
+    assert resumed == reference
+
+parser = argparse.ArgumentParser(description="Check that a killed transcription resumes with identical output.")
+parser.add_argument("--seconds", type=float, default=300, help="Length of the generated test audio")
+parser.add_argument("--chunk-seconds", type=float, default=60, help="Checkpoint chunk length")
+parser.add_argument("--chunk-latency", type=float, default=0.5, help="Stub model seconds per chunk")
+parser.add_argument("--repeat-rate", type=float, default=0.8, help="Chance that a stub window repeats the previous one")
+parser.add_argument("--backend", default="stub", choices=["stub", "whisper"])
+parser.add_argument("--model", default="tiny")
+parser.add_argument("--language", default="en")
+parser.add_argument("--preset", default="beam-accurate",
+                    help="Decoding preset (the default conditions on previous text and guards against repetition)")
+parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for the first checkpoint")
+parser.add_argument("--worker", nargs=2, metavar=("AUDIO", "OUTPUT"), help=argparse.SUPPRESS)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], args.worker[1], args.model, args.language, args.preset)
+        sys.exit(0)
+    sys.exit(0 if run_check(args) else 1)
@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const uploadForm = document.getElementById('uploadForm');
     const transcribeForm = document.getElementById('transcribeForm');
     const downloadForm = document.getElementById('downloadForm');
+    const muxForm = document.getElementById('muxForm');
     const fileInput = document.getElementById('fileInput');
     const browseBtn = document.getElementById('browseBtn');
     const dropArea = document.getElementById('dropArea');
@@ -161,6 +162,9 @@ document.addEventListener('DOMContentLoaded', function() {
                     // Show success message
                     showAlert('Success', 'File uploaded successfully!', 'success');
                     
+                    // Subtitles can only be attached to video uploads
+                    muxForm.classList.toggle('d-none', !response.has_video);
+                    
                     // Move to step 2 with animation
                     step1.classList.add('d-none');
                     step2.classList.remove('d-none');
@@ -221,6 +225,9 @@ document.addEventListener('DOMContentLoaded', function() {
             // Show preview
             transcriptPreview.textContent = data.preview;
             
+            // Offer a track choice when several subtitle tracks were generated
+            document.getElementById('trackCard').classList.toggle('d-none', !(data.tracks && data.tracks.length > 1));
+            
             // Move to step 3 with animation
             step2.classList.add('d-none');
             step3.classList.remove('d-none');
@@ -283,6 +290,9 @@ document.addEventListener('DOMContentLoaded', function() {
         // Create form data
         const formData = new FormData();
         formData.append('format', format);
+        if (!document.getElementById('trackCard').classList.contains('d-none')) {
+            formData.append('track', document.getElementById('trackSelect').value);
+        }
         
         // Add loading indicator to button
         const downloadBtn = document.getElementById('downloadBtn');
@@ -365,6 +375,66 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Video with subtitles handler
+    muxForm.addEventListener('submit', function(e) {
+        e.preventDefault();
+        
+        const formData = new FormData(muxForm);
+        const container = formData.get('container');
+        formData.append('check', '1');
+        
+        // Add loading indicator to button
+        const muxBtn = document.getElementById('muxBtn');
+        const originalBtnText = muxBtn.innerHTML;
+        muxBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i> Adding subtitles...';
+        muxBtn.disabled = true;
+        
+        // Check the request first so errors can be shown here, then let the browser
+        // stream the video straight to disk instead of buffering it in memory
+        fetch('/mux', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json().then(data => {
+            if (!response.ok) {
+                throw new Error(data.error || `HTTP error! Status: ${response.status}`);
+            }
+            return data;
+        }))
+        .then(data => {
+            // A native submit doesn't fire this handler again
+            muxForm.submit();
+            
+            // Reset button
+            muxBtn.innerHTML = originalBtnText;
+            muxBtn.disabled = false;
+            
+            showAlert('Success', `Your ${container.toUpperCase()} download of ${data.filename} will start shortly.`, 'success');
+        })
+        .catch(error => {
+            // Reset button
+            muxBtn.innerHTML = originalBtnText;
+            muxBtn.disabled = false;
+            
+            showAlert('Error', error.message || 'Adding subtitles to the video failed. Please try again.');
+            console.error('Mux error:', error);
+        });
+    });
+    
+    // The download frame only loads a page when the server answered with an error instead of the video
+    document.getElementById('muxTarget').addEventListener('load', function() {
+        if (this.contentDocument.URL === 'about:blank') {
+            return;
+        }
+        let message = 'Adding subtitles to the video failed. Please try again.';
+        try {
+            message = JSON.parse(this.contentDocument.body.textContent).error || message;
+        } catch (error) {
+            console.error('Mux error:', error);
+        }
+        showAlert('Error', message);
+    });
+
     // Navigation buttons
     backToUploadBtn.addEventListener('click', function() {
         step2.classList.add('d-none');
@@ -0,0 +1,450 @@
+"""
+Real-time streaming transcription for the subtitle generator app.
+This module turns a live stream of audio into partial and finalized subtitle
+segments. Incoming 16kHz samples go into a ring buffer and the resident
+Whisper model is run on a sliding window that starts at the last finalized
+segment, so the unfinished tail is decoded again (the overlap) as more audio
+arrives.
+
+Window decodes may also use the governor's slots reserved for streams (see
+WHISPER_RESERVED_STREAM_SLOTS), so they don't have to queue behind long file
+transcriptions. If no slot frees up within WHISPER_STREAM_SLOT_TIMEOUT the
+window is skipped and the client gets a "busy" event; the audio stays
+buffered for the next window.
+
+Frames that arrived while a window was decoding are taken together, so the
+next decode covers all audio received so far. Without a language from the
+client, the language is detected again on each window until the first
+segment is final, rather than pinned from the first second of audio.
+
+Each open stream holds one gunicorn thread for its whole session, so the
+number of live streams is capped (WHISPER_MAX_STREAMS) and gunicorn's
+--threads should leave room for them on top of uploads, downloads and file
+transcriptions.
+
+It can be tested without a server by replaying a local file as a fake live
+stream:
+    python streaming_transcriber.py recording.wav --model tiny
+    python streaming_transcriber.py recording.wav --url ws://127.0.0.1:5000/stream
+"""
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import subprocess
+import numpy as np
+import torch
+import whisper_utils
+import subtitle_formatter
+import concurrency_governor
+import decode_presets
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Streaming configuration (can be overridden with environment variables)
+STEP_SECONDS = float(os.environ.get("WHISPER_STREAM_STEP_SECONDS", "1.0"))
+MAX_WINDOW_SECONDS = float(os.environ.get("WHISPER_STREAM_MAX_WINDOW_SECONDS", "20"))
+MIN_WINDOW_SECONDS = 1.0
+
+# Trailing audio never finalized until more audio arrives
+OVERLAP_SECONDS = float(os.environ.get("WHISPER_STREAM_OVERLAP_SECONDS", "2.0"))
+
+# Seconds a window waits for an inference slot before the client is told the server is busy
+SLOT_TIMEOUT = float(os.environ.get("WHISPER_STREAM_SLOT_TIMEOUT", "2.0"))
+
+# Live streams served at once by each worker process
+MAX_STREAMS = int(os.environ.get("WHISPER_MAX_STREAMS", "2"))
+
+# Input formats and tasks accepted from clients
+INPUT_FORMATS = ("pcm_s16le", "pcm_f32le", "ogg", "webm")
+STREAM_TASKS = ("transcribe", "translate")
+
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of the most recent samples, addressed by absolute sample index.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.end = 0  # Absolute index one past the newest sample
+
+    @property
+    def start(self):
+        """Absolute index of the oldest sample still held."""
+        return max(0, self.end - self.capacity)
+
+    def append(self, samples):
+        samples = samples[-self.capacity:]
+        position = self.end % self.capacity
+        first = min(len(samples), self.capacity - position)
+        self.data[position:position + first] = samples[:first]
+        self.data[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+
+    def get(self, start, end):
+        """Return a contiguous copy of samples [start, end)."""
+        start = max(start, self.start)
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+        first, last = start % self.capacity, end % self.capacity or self.capacity
+        if first < last:
+            return self.data[first:last].copy()
+        return np.concatenate([self.data[first:], self.data[:last]])
+
+class FFmpegStreamDecoder:
+    """
+    Decode a streamed Ogg or WebM (Opus) container to 16kHz float32 samples with FFmpeg.
+    """
+
+    def __init__(self, container):
+        cmd = [
+            'ffmpeg', '-nostdin', '-loglevel', 'error',
+            '-f', container, '-i', 'pipe:0',
+            '-f', 'f32le', '-ar', str(SAMPLE_RATE), '-ac', '1', 'pipe:1'
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.output = queue.Queue()
+        self.remainder = b""
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        while True:
+            chunk = os.read(self.process.stdout.fileno(), 64 * 1024)
+            if not chunk:
+                break
+            self.output.put(chunk)
+        self.output.put(None)
+
+    def _drain(self, block=False):
+        chunks = [self.remainder]
+        while True:
+            try:
+                chunk = self.output.get(block=block)
+            except queue.Empty:
+                break
+            if chunk is None:
+                break
+            chunks.append(chunk)
+        data = b"".join(chunks)
+        # Keep whole float32 samples only; a split sample is completed by the next read
+        usable = len(data) - len(data) % 4
+        self.remainder = data[usable:]
+        return np.frombuffer(data[:usable], dtype=np.float32)
+
+    def decode(self, data):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+        return self._drain()
+
+    def close(self):
+        """Flush FFmpeg and return any remaining samples."""
+        self.process.stdin.close()
+        samples = self._drain(block=True)
+        self.process.wait()
+        return samples
+
+def decode_frame(data, input_format, decoder=None):
+    """Convert one binary frame from the client to float32 samples."""
+    if input_format == "pcm_s16le":
+        return np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16).astype(np.float32) / 32768.0
+    if input_format == "pcm_f32le":
+        return np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+    return decoder.decode(data)
+
+class StreamingTranscriber:
+    """
+    Incrementally transcribe a live audio stream.
+
+    feed() and finish() return lists of events:
+        {"type": "partial", "start": ..., "end": ..., "text": ...}
+        {"type": "final", "id": ..., "start": ..., "end": ..., "text": ...}
+    """
+
+    def __init__(self, model_name="tiny", language=None, task="transcribe", preset="greedy-fast"):
+        self.model_name = model_name
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.language = language
+        self.options = {"task": task, **decode_presets.get_decode_options(preset)}
+        self.buffer = RingBuffer(int(MAX_WINDOW_SECONDS * 1.5 * SAMPLE_RATE))
+        self.committed = 0  # Absolute sample index up to which segments are final
+        self.last_run = 0  # Buffer end at the last decode
+        self.segments = []
+
+    def _decode_window(self, final):
+        # Audio that fell out of the ring buffer while the server was busy is lost
+        start, end = max(self.committed, self.buffer.start), self.buffer.end
+        audio = self.buffer.get(start, end)
+        offset = start / SAMPLE_RATE
+
+        # Each window takes an inference slot and a model instance only while it decodes;
+        # the last window waits as long as it takes so the end of the stream isn't lost
+        try:
+            with concurrency_governor.governor.job(timeout=None if final else SLOT_TIMEOUT, reserved=True) as threads:
+                torch.set_num_threads(threads)
+                with whisper_utils.checkout_model(self.model_name, self.device) as model:
+                    # The window grows from the start of the stream until a segment is final,
+                    # so each detection sees more audio than the last
+                    language = self.language or whisper_utils.detect_language(model, audio)
+                    prompt = "".join(segment["text"] for segment in self.segments)[-whisper_utils.PROMPT_CONTEXT_CHARS:] or None
+                    result = model.transcribe(audio, language=language, initial_prompt=prompt, **self.options)
+        except TimeoutError:
+            logger.info(f"No inference slot for a stream window within {SLOT_TIMEOUT}s")
+            return [{"type": "busy", "buffered_seconds": (self.buffer.end - self.committed) / SAMPLE_RATE}]
+
+        window_segments = [segment for segment in result["segments"] if segment["text"].strip()]
+        window_seconds = len(audio) / SAMPLE_RATE
+
+        # Finalize everything except the last segment and anything inside the overlap
+        # (unless the stream ended, or the window is full and must move on)
+        force = final or window_seconds >= MAX_WINDOW_SECONDS
+        ready = []
+        for index, segment in enumerate(window_segments):
+            is_last = index == len(window_segments) - 1
+            if force or (not is_last and segment["end"] <= window_seconds - OVERLAP_SECONDS):
+                ready.append(segment)
+
+        if ready and not self.language:
+            # Keep the language the first final segment was decoded in
+            self.language = language
+
+        events = []
+        for segment in ready:
+            final_segment = {
+                "id": len(self.segments),
+                "start": segment["start"] + offset,
+                "end": segment["end"] + offset,
+                "text": segment["text"]
+            }
+            self.segments.append(final_segment)
+            events.append({"type": "final", **final_segment})
+
+        if force:
+            self.committed = end
+        elif ready:
+            self.committed = start + int(ready[-1]["end"] * SAMPLE_RATE)
+
+        pending = window_segments[len(ready):]
+        if pending:
+            events.append({
+                "type": "partial",
+                "start": pending[0]["start"] + offset,
+                "end": pending[-1]["end"] + offset,
+                "text": "".join(segment["text"] for segment in pending)
+            })
+        return events
+
+    def feed(self, samples):
+        """Add samples to the stream and decode when a step's worth has arrived."""
+        if len(samples) == 0:
+            return []
+        self.buffer.append(samples)
+        if self.buffer.end - self.last_run < STEP_SECONDS * SAMPLE_RATE:
+            return []
+        if self.buffer.end - self.committed < MIN_WINDOW_SECONDS * SAMPLE_RATE:
+            return []
+        self.last_run = self.buffer.end
+        return self._decode_window(final=False)
+
+    def finish(self):
+        """Finalize whatever audio is left when the stream closes."""
+        if self.buffer.end - self.committed < 0.1 * SAMPLE_RATE:
+            return []
+        return self._decode_window(final=True)
+
+    def get_result(self):
+        """Return the finalized segments shaped like a Whisper transcription result."""
+        return {
+            "text": "".join(segment["text"] for segment in self.segments),
+            "segments": self.segments,
+            "language": self.language
+        }
+
+    def to_srt(self, base_filename="stream"):
+        """Format the finalized segments as SRT."""
+        content, _ = subtitle_formatter.to_srt(self.get_result(), base_filename)
+        return content
+
+def handle_websocket(ws):
+    """
+    Serve one streaming session over a WebSocket.
+
+    The client first sends a JSON text message with its settings, e.g.
+    {"format": "pcm_s16le", "model": "tiny", "language": "en", "task": "transcribe"},
+    then binary audio frames, then {"event": "end"} (or simply closes the socket).
+    The server sends partial and final segment events, {"type": "busy"} when a
+    window was skipped for lack of capacity and, at the end,
+    {"type": "done", "srt": ...}.
+    """
+    # Each session pins a server thread, so refuse streams beyond the cap up front
+    if not _stream_slots.acquire(blocking=False):
+        ws.send(json.dumps({"type": "error", "error": "Too many live streams. Please try again later."}))
+        return
+    try:
+        _serve_stream(ws)
+    finally:
+        _stream_slots.release()
+
+def _serve_stream(ws):
+    config = json.loads(ws.receive())
+    input_format = config.get("format", "pcm_s16le")
+    model_name = config.get("model", "tiny")
+    task = config.get("task", "transcribe")
+    preset = config.get("preset", "greedy-fast")
+    if input_format not in INPUT_FORMATS:
+        ws.send(json.dumps({"type": "error", "error": f"Unsupported format: {input_format}"}))
+        return
+    if model_name not in whisper_utils.get_available_models():
+        ws.send(json.dumps({"type": "error", "error": f"Unsupported model: {model_name}"}))
+        return
+    if task not in STREAM_TASKS:
+        ws.send(json.dumps({"type": "error", "error": f"Unsupported task: {task}"}))
+        return
+    if preset not in decode_presets.DECODE_PRESETS:
+        ws.send(json.dumps({"type": "error", "error": f"Unsupported decoding preset: {preset}"}))
+        return
+
+    transcriber = StreamingTranscriber(
+        model_name,
+        language=config.get("language") or None,
+        task=task,
+        preset=preset
+    )
+    decoder = FFmpegStreamDecoder(input_format) if input_format in ("ogg", "webm") else None
+    ws.send(json.dumps({"type": "ready"}))
+
+    try:
+        ended = False
+        while not ended:
+            message = ws.receive()
+            if message is None:
+                break
+
+            # Take every frame that is already waiting as well, so one decode covers all audio
+            # received so far instead of a backlog building up one frame per decode
+            chunks = []
+            while message is not None:
+                if isinstance(message, str):
+                    if json.loads(message).get("event") == "end":
+                        ended = True
+                        break
+                else:
+                    chunks.append(decode_frame(message, input_format, decoder))
+                message = ws.receive(timeout=0)
+
+            if chunks:
+                for event in transcriber.feed(np.concatenate(chunks)):
+                    ws.send(json.dumps(event))
+
+        if decoder:
+            remaining = decoder.close()
+            decoder = None
+            for event in transcriber.feed(remaining):
+                ws.send(json.dumps(event))
+
+        for event in transcriber.finish():
+            ws.send(json.dumps(event))
+        ws.send(json.dumps({"type": "done", "srt": transcriber.to_srt()}))
+    finally:
+        if decoder:
+            decoder.process.kill()
+
+def replay_file(file_path, model_name="tiny", language=None, chunk_seconds=0.1, realtime=True, url=None):
+    """
+    Replay a local audio file as a fake live stream and collect the events.
+
+    Args:
+        file_path: Audio or video file to replay
+        model_name: Whisper model to use
+        language: Language code (optional, auto-detected if None)
+        chunk_seconds: Audio sent per frame
+        realtime: Pace frames at real-time speed
+        url: WebSocket URL of a running app; transcribes in-process if None
+
+    Returns:
+        Tuple of (events, srt_content); each event gets "latency", the seconds between
+        the end of its audio being sent and the event arriving
+    """
+    audio = whisper_utils.decode_audio(file_path)
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    events = []
+    start = time.monotonic()
+
+    def stamp(event):
+        if "end" in event:
+            event["latency"] = max(0.0, (time.monotonic() - start) - event["end"])
+        events.append(event)
+
+    if url:
+        import simple_websocket
+
+        ws = simple_websocket.Client(url)
+        ws.send(json.dumps({"format": "pcm_f32le", "model": model_name, "language": language}))
+        json.loads(ws.receive())  # Ready
+        start = time.monotonic()
+
+        def receive_events(timeout):
+            while True:
+                message = ws.receive(timeout=timeout)
+                if message is None:
+                    return None
+                event = json.loads(message)
+                if event["type"] == "done":
+                    return event["srt"]
+                stamp(event)
+
+        for position in range(0, len(audio), chunk):
+            ws.send(audio[position:position + chunk].tobytes())
+            receive_events(timeout=0)
+            if realtime:
+                time.sleep(max(0.0, start + (position + chunk) / SAMPLE_RATE - time.monotonic()))
+        ws.send(json.dumps({"event": "end"}))
+        srt = receive_events(timeout=None)
+        ws.close()
+        return events, srt
+
+    transcriber = StreamingTranscriber(model_name, language=language)
+    for position in range(0, len(audio), chunk):
+        for event in transcriber.feed(audio[position:position + chunk]):
+            stamp(event)
+        if realtime:
+            time.sleep(max(0.0, start + (position + chunk) / SAMPLE_RATE - time.monotonic()))
+    for event in transcriber.finish():
+        stamp(event)
+    return events, transcriber.to_srt()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Replay an audio file as a live stream and print the captions.")
+    parser.add_argument("audio", help="Audio or video file to replay")
+    parser.add_argument("--model", default="tiny", help="Whisper model to use")
+    parser.add_argument("--language", default=None, help="Language code (auto-detected if omitted)")
+    parser.add_argument("--url", default=None, help="WebSocket URL, e.g. ws://127.0.0.1:5000/stream")
+    parser.add_argument("--fast", action="store_true", help="Send audio as fast as possible instead of in real time")
+    args = parser.parse_args()
+
+    events, srt = replay_file(args.audio, args.model, args.language, realtime=not args.fast, url=args.url)
+    for event in events:
+        if "end" not in event:
+            # Busy and error events carry no segment
+            print(f"{event['type']:>7} {json.dumps({key: value for key, value in event.items() if key != 'type'})}")
+            continue
+        print(f"{event['type']:>7} {event['start']:7.2f}-{event['end']:7.2f} (+{event['latency']:.2f}s) {event['text'].strip()}")
+
+    latencies = [event["latency"] for event in events if event["type"] == "final"]
+    if latencies:
+        print(f"\nFinal segments: {len(latencies)}, latency avg {sum(latencies) / len(latencies):.2f}s,"
+              f" max {max(latencies):.2f}s\n")
+    print(srt)
+    sys.exit(0)
@@ -0,0 +1,140 @@
+"""
+Deterministic stand-in for a Whisper model.
+This module lets the web tier be load-tested without real models: it returns
+synthetic segments with configurable latency and size, derived only from the
+audio length, options and prompt so repeated runs produce identical output.
+
+Like Whisper it decodes one window at a time through model.decode, so the
+repetition guard sees every window, and each window's text depends on the
+text before it (initial_prompt plus earlier windows) when conditioning on
+previous text is enabled.
+
+Select it with WHISPER_BACKEND=stub. Behaviour is tuned with:
+    STUB_WHISPER_LATENCY         fixed seconds per transcription (default 0.5)
+    STUB_WHISPER_REALTIME_FACTOR extra seconds per second of audio (default 0)
+    STUB_WHISPER_SEGMENT_SECONDS length of each synthetic segment (default 4)
+    STUB_WHISPER_WORDS           words per segment (default 12)
+    STUB_WHISPER_REPEAT_RATE     chance that a window repeats the previous one (default 0)
+"""
+import os
+import time
+import random
+import logging
+import dataclasses
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Stub configuration (can be overridden with environment variables)
+LATENCY = float(os.environ.get("STUB_WHISPER_LATENCY", "0.5"))
+REALTIME_FACTOR = float(os.environ.get("STUB_WHISPER_REALTIME_FACTOR", "0"))
+SEGMENT_SECONDS = float(os.environ.get("STUB_WHISPER_SEGMENT_SECONDS", "4"))
+WORDS_PER_SEGMENT = int(os.environ.get("STUB_WHISPER_WORDS", "12"))
+REPEAT_RATE = float(os.environ.get("STUB_WHISPER_REPEAT_RATE", "0"))
+
+PROMPT_CHARS = 400  # Context kept for conditioning, roughly Whisper's 224-token prompt
+
+VOCABULARY = (
+    "the quick brown fox jumps over lazy dog while subtitles appear on screen "
+    "every speaker talks about weather music travel food science history and news"
+).split()
+
+@dataclasses.dataclass
+class StubDecodingResult:
+    """The fields of whisper.DecodingResult that the repetition guard reads and replaces."""
+    text: str
+    tokens: list = dataclasses.field(default_factory=list)
+    temperature: float = 0.0
+    avg_logprob: float = -0.2
+    compression_ratio: float = 1.5
+    no_speech_prob: float = 0.01
+
+class StubWhisperModel:
+    """
+    Mimics the parts of whisper.model.Whisper used by whisper_utils.
+    """
+
+    is_multilingual = False
+    device = "cpu"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def decode(self, window, options):
+        """
+        Decode one window of audio.
+
+        Args:
+            window: Samples of the window (a new object per window, like Whisper's mel segments)
+            options: Dictionary with the window's seed, prompt and previous text
+
+        Returns:
+            StubDecodingResult for the window
+        """
+        # Seed from the inputs and the prompt so the same context always gives the same text
+        rng = random.Random(f"{options['seed']}:{options['prompt']}")
+        if options["previous_text"] and rng.random() < REPEAT_RATE:
+            # Mimic Whisper getting stuck repeating itself
+            return StubDecodingResult(text=options["previous_text"])
+        words = " ".join(rng.choice(VOCABULARY) for _ in range(WORDS_PER_SEGMENT))
+        return StubDecodingResult(text=" " + words.capitalize() + ".")
+
+    def transcribe(self, audio, task="transcribe", language=None, initial_prompt=None,
+                   condition_on_previous_text=True, no_speech_threshold=0.6, **options):
+        """
+        Return synthetic segments covering the audio after sleeping for the configured latency.
+
+        Args:
+            audio: Decoded 16kHz samples
+            task: "transcribe" or "translate"
+            language: Language code reported in the result
+            initial_prompt: Text the first window is conditioned on
+            condition_on_previous_text: Condition each window on the text before it
+            no_speech_threshold: Windows more likely silent than this are dropped
+            options: Other decoding options (accepted and ignored)
+
+        Returns:
+            Dictionary shaped like a Whisper transcription result
+        """
+        duration = len(audio) / SAMPLE_RATE
+        time.sleep(LATENCY + duration * REALTIME_FACTOR)
+
+        segments = []
+        prompt = (initial_prompt or "")[-PROMPT_CHARS:]
+        # A window may repeat the last sentence of the prompt, just as Whisper can carry a loop across chunks
+        previous_text = prompt[prompt.rfind(". ") + 1:] if prompt else None
+        start = 0.0
+        while start < duration:
+            end = min(start + SEGMENT_SECONDS, duration)
+            window = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+            result = self.decode(window, {
+                "seed": f"{self.model_name}:{task}:{len(audio)}:{start}",
+                "prompt": prompt,
+                "previous_text": previous_text
+            })
+
+            # Windows the repetition guard skipped come back as silence
+            if result.no_speech_prob <= no_speech_threshold:
+                segments.append({
+                    "id": len(segments),
+                    "seek": round(start * 100),
+                    "start": start,
+                    "end": end,
+                    "text": result.text,
+                    "tokens": result.tokens,
+                    "temperature": result.temperature,
+                    "avg_logprob": result.avg_logprob,
+                    "compression_ratio": result.compression_ratio,
+                    "no_speech_prob": result.no_speech_prob
+                })
+                previous_text = result.text
+                prompt = (prompt + result.text)[-PROMPT_CHARS:] if condition_on_previous_text else ""
+            start = end
+
+        return {
+            "text": "".join(segment["text"] for segment in segments),
+            "segments": segments,
+            "language": language or "en"
+        }
@@ -112,3 +112,10 @@ def to_txt(result, base_filename):
     output_filename = f"{base_filename}.txt"
     
     return content, output_filename
+
+# Formatter for each supported subtitle format
+FORMATTERS = {
+    "srt": to_srt,
+    "vtt": to_vtt,
+    "txt": to_txt
+}
@@ -0,0 +1,153 @@
+"""
+Soft-subtitle muxing for the subtitle generator app.
+This module attaches one or more subtitle tracks to the original upload with
+FFmpeg stream copy, so no audio or video is re-encoded, and streams the
+resulting MKV/MP4 while FFmpeg writes it.
+"""
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+import subtitle_formatter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Output containers: FFmpeg muxer, subtitle codec, mimetype and extra output options
+CONTAINERS = {
+    "mkv": {
+        "muxer": "matroska",
+        "subtitle_codec": "srt",
+        "mimetype": "video/x-matroska",
+        # Matroska can be written to a pipe as is
+        "options": []
+    },
+    "mp4": {
+        "muxer": "mp4",
+        "subtitle_codec": "mov_text",
+        "mimetype": "video/mp4",
+        # Fragmented MP4 so the file can be streamed without seeking back
+        "options": ["-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+    }
+}
+
+# ISO 639-2 codes for subtitle track language tags
+ISO_639_2 = {
+    "en": "eng", "es": "spa", "fr": "fra", "de": "deu", "it": "ita",
+    "pt": "por", "nl": "nld", "ru": "rus", "zh": "zho", "ja": "jpn",
+    "ar": "ara", "hi": "hin", "ko": "kor", "tr": "tur", "pl": "pol",
+    "vi": "vie", "sv": "swe", "uk": "ukr", "fa": "fas"
+}
+
+# Upload extensions that can carry a video stream to attach subtitles to
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'webm'}
+
+CHUNK_SIZE = 64 * 1024
+
+def _read_log(log_file):
+    """Return what FFmpeg wrote to its stderr log file."""
+    log_file.flush()
+    log_file.seek(0)
+    return log_file.read().decode("utf-8", errors="replace")
+
+def build_mux_command(media_path, subtitle_tracks, container):
+    """
+    Build the FFmpeg command that copies the media streams and adds subtitle tracks.
+
+    Args:
+        media_path: Path to the original upload
+        subtitle_tracks: List of (srt_path, language_code, title) tuples
+        container: Key of CONTAINERS
+
+    Returns:
+        The command as a list of arguments
+    """
+    settings = CONTAINERS[container]
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', media_path]
+    for srt_path, _, _ in subtitle_tracks:
+        cmd += ['-i', srt_path]
+
+    # Keep the original video and audio, drop any existing subtitle or data streams
+    cmd += ['-map', '0:v?', '-map', '0:a?']
+    for index in range(len(subtitle_tracks)):
+        cmd += ['-map', str(index + 1)]
+
+    cmd += ['-c:v', 'copy', '-c:a', 'copy', '-c:s', settings["subtitle_codec"]]
+    for index, (_, language, title) in enumerate(subtitle_tracks):
+        cmd += [
+            f'-metadata:s:s:{index}', f'language={ISO_639_2.get(language, "und")}',
+            f'-metadata:s:s:{index}', f'title={title}',
+            f'-disposition:s:{index}', 'default' if index == 0 else '0'
+        ]
+
+    cmd += settings["options"] + ['-f', settings["muxer"], 'pipe:1']
+    return cmd
+
+def stream_muxed_video(media_path, tracks, container="mkv"):
+    """
+    Mux subtitle tracks into the media file and yield the output as it is written.
+
+    The first chunk is produced before this function returns, so FFmpeg
+    failures on bad input are raised here rather than midway through a response.
+
+    Args:
+        media_path: Path to the original upload
+        tracks: List of (result, language_code, title) tuples, one per subtitle track
+        container: "mkv" or "mp4"
+
+    Returns:
+        Iterator of bytes chunks
+    """
+    if container not in CONTAINERS:
+        raise ValueError(f"Unsupported container: {container}")
+
+    work_dir = tempfile.mkdtemp(prefix="mux_")
+    try:
+        subtitle_tracks = []
+        for index, (result, language, title) in enumerate(tracks):
+            content, _ = subtitle_formatter.to_srt(result, "")
+            srt_path = os.path.join(work_dir, f"track{index}.srt")
+            with open(srt_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            subtitle_tracks.append((srt_path, language, title))
+
+        cmd = build_mux_command(media_path, subtitle_tracks, container)
+        logger.debug(f"Running FFmpeg command: {' '.join(cmd)}")
+        # FFmpeg's messages go to a file; a pipe read only after stdout ends could fill up and stall it
+        log_file = open(os.path.join(work_dir, "ffmpeg.log"), "w+b")
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log_file)
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    first_chunk = process.stdout.read(CHUNK_SIZE)
+    if not first_chunk:
+        process.wait()
+        stderr = _read_log(log_file)
+        process.stdout.close()
+        log_file.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        logger.error(f"FFmpeg error: {stderr}")
+        raise Exception(f"Failed to mux subtitles: {stderr}")
+
+    def generate():
+        try:
+            yield first_chunk
+            while True:
+                chunk = process.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            if process.wait() != 0:
+                logger.error(f"FFmpeg error while streaming muxed video: {_read_log(log_file)}")
+        finally:
+            # Stop FFmpeg if the client went away mid-stream
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            log_file.close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return generate()
@@ -1,13 +1,46 @@
 import os
+import hashlib
 import logging
-import tempfile
+import threading
 import subprocess
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 import whisper
 import torch
+import audio_cache
+import concurrency_governor
+import decode_presets
+import job_store
+import stub_whisper
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# "whisper" for real models, "stub" for the deterministic load-testing model
+WHISPER_BACKEND = os.environ.get("WHISPER_BACKEND", "whisper")
+
+# Number of Whisper models kept resident in each worker process
+MODEL_CACHE_SIZE = int(os.environ.get("WHISPER_MODEL_CACHE_SIZE", "1"))
+
+# Idle instances kept per resident model; extra copies loaded for concurrent jobs are dropped afterwards
+MODEL_POOL_SIZE = int(os.environ.get("WHISPER_MODEL_POOL_SIZE", "1"))
+
+# Number of encoded 30-second windows kept per job for reuse
+ENCODER_CACHE_ENTRIES = int(os.environ.get("WHISPER_ENCODER_CACHE_ENTRIES", "4"))
+
+# Jobs with at least this much audio are decoded in checkpointed chunks
+CHECKPOINT_MIN_SECONDS = float(os.environ.get("WHISPER_CHECKPOINT_MIN_SECONDS", "600"))
+CHECKPOINT_CHUNK_SECONDS = float(os.environ.get("WHISPER_CHECKPOINT_CHUNK_SECONDS", "300"))
+
+# Characters of previous text carried into the next chunk as decoder context
+PROMPT_CONTEXT_CHARS = 400
+
+# Idle model instances per (model name, device), least recently used first
+_model_pools = OrderedDict()
+_model_pools_lock = threading.Lock()
+_models_in_use = 0  # Checked-out instances, i.e. jobs decoding in this process
+
 # Language code to full name mapping
 LANGUAGE_MAP = {
     "en": "English",
@@ -31,6 +64,9 @@ LANGUAGE_MAP = {
     "fa": "Persian"
 }
 
+# Audio and video file extensions the transcriber accepts
+SUPPORTED_EXTENSIONS = {'mp3', 'mp4', 'wav', 'avi', 'mov', 'flac', 'ogg', 'm4a', 'webm'}
+
 def get_available_models():
     """Return a list of available Whisper models."""
     return {
@@ -45,92 +81,413 @@ def get_supported_languages():
     """Return a dictionary of supported languages."""
     return LANGUAGE_MAP
 
-def extract_audio(video_path):
-    """Extract audio from video file using FFmpeg."""
+def decode_audio(file_path, threads=0):
+    """
+    Decode any audio or video file to 16kHz mono float32 samples using FFmpeg.
+    
+    Args:
+        file_path: Path to audio or video file
+        threads: Number of threads FFmpeg may use (0 lets FFmpeg decide)
+    
+    Returns:
+        NumPy array of samples in the range [-1, 1]
+    """
+    cmd = [
+        'ffmpeg', '-nostdin', '-threads', str(threads),
+        '-i', file_path,
+        '-vn',  # No video
+        '-f', 'f32le',  # Raw float32 samples
+        '-ar', str(whisper.audio.SAMPLE_RATE),  # 16kHz sample rate
+        '-ac', '1',  # Mono
+        '-'
+    ]
+    
+    logger.debug(f"Running FFmpeg command: {' '.join(cmd)}")
+    
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    if result.returncode != 0:
+        stderr = result.stderr.decode('utf-8', errors='replace')
+        logger.error(f"FFmpeg error: {stderr}")
+        raise Exception(f"Failed to decode audio: {stderr}")
+    
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+def get_media_duration(file_path):
+    """
+    Return the duration of an audio or video file in seconds using FFprobe.
+    
+    Falls back to an estimate from the file size if FFprobe cannot read it.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        file_path
+    ]
+    
     try:
-        audio_path = tempfile.NamedTemporaryFile(suffix='.wav', delete=False).name
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode == 0:
+            return float(result.stdout.strip())
+        logger.warning(f"FFprobe error: {result.stderr}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read media duration: {str(e)}")
+    
+    # Assume a typical 128 kbit/s stream
+    return os.path.getsize(file_path) / 16000
+
+class EncoderCache:
+    """
+    Bounded cache of audio encoder outputs keyed by the content of the mel window.
+    
+    Temperature fallbacks retry the current 30-second window and language
+    detection encodes the first one again; with a cache active they only pay
+    for the encoder once.
+    """
+    
+    def __init__(self, max_entries=ENCODER_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get_or_compute(self, mel, compute):
+        key = (
+            tuple(mel.shape),
+            str(mel.dtype),
+            hashlib.sha1(mel.detach().float().cpu().numpy().tobytes()).hexdigest()
+        )
+        
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
         
-        # Run FFmpeg to extract audio
-        cmd = [
-            'ffmpeg', '-i', video_path, 
-            '-vn',  # No video
-            '-acodec', 'pcm_s16le',  # PCM 16-bit
-            '-ar', '16000',  # 16kHz sample rate
-            '-ac', '1',  # Mono
-            '-y',  # Overwrite output
-            audio_path
+        self.misses += 1
+        output = compute(mel)
+        self.entries[key] = output
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return output
+
+class _CachedEncoder(torch.nn.Module):
+    """Wrap a Whisper audio encoder so it consults the active EncoderCache, if any."""
+    
+    def __init__(self, encoder):
+        super().__init__()
+        self.encoder = encoder
+        self.cache = None
+    
+    def forward(self, mel):
+        if self.cache is None:
+            return self.encoder(mel)
+        return self.cache.get_or_compute(mel, self.encoder)
+
+@contextmanager
+def _encoder_cache(model, cache):
+    """Activate an EncoderCache on a checked-out model."""
+    if not isinstance(getattr(model, "encoder", None), _CachedEncoder):
+        # Stub models have no encoder to cache
+        yield cache
+        return
+    
+    model.encoder.cache = cache
+    try:
+        yield cache
+    finally:
+        model.encoder.cache = None
+
+class _GuardedDecode:
+    """Route model.decode through the active RepetitionGuard, if any."""
+    
+    def __init__(self, decode):
+        self.decode = decode
+        self.guard = None
+    
+    def __call__(self, mel, *args, **kwargs):
+        if self.guard is None:
+            return self.decode(mel, *args, **kwargs)
+        return self.guard.decode(lambda mel, options: self.decode(mel, options, **kwargs), mel, *args)
+
+@contextmanager
+def _repetition_guard(model, guard):
+    """Activate a RepetitionGuard on a checked-out model."""
+    model.decode.guard = guard
+    try:
+        yield guard
+    finally:
+        model.decode.guard = None
+
+def _load_model(model_name, device):
+    """Load a new model instance with the encoder cache and repetition guard hooks."""
+    if WHISPER_BACKEND == "stub":
+        logger.info(f"Loading stub Whisper model: {model_name}")
+        model = stub_whisper.StubWhisperModel(model_name)
+    else:
+        logger.info(f"Loading Whisper model: {model_name}")
+        model = whisper.load_model(model_name, device=device)
+        model.encoder = _CachedEncoder(model.encoder)
+    model.decode = _GuardedDecode(model.decode)
+    return model
+
+@contextmanager
+def checkout_model(model_name, device):
+    """
+    Lend a resident model instance to the calling job, loading one if none is idle.
+    
+    Whisper keeps decoding state on the model (its kv-cache hooks write into
+    the shared decoder modules), so an instance must never run two jobs at
+    once. Each job takes an idle instance for its duration and returns it
+    afterwards. Concurrent jobs load extra copies, of which only
+    MODEL_POOL_SIZE stay resident once they return; the most recently used
+    models stay in memory so later jobs in the same worker skip the load.
+    
+    Yields:
+        A model instance owned by the caller until the block exits
+    """
+    global _models_in_use
+    
+    key = (model_name, device)
+    with _model_pools_lock:
+        idle = _model_pools.get(key)
+        model = idle.pop() if idle else None
+        _models_in_use += 1
+    
+    if model is None:
+        # Load outside the lock so other jobs can still check out resident models
+        model = _load_model(model_name, device)
+    
+    try:
+        yield model
+    finally:
+        with _model_pools_lock:
+            _models_in_use -= 1
+            idle = _model_pools.setdefault(key, [])
+            _model_pools.move_to_end(key)
+            if len(idle) < MODEL_POOL_SIZE:
+                idle.append(model)
+            while len(_model_pools) > MODEL_CACHE_SIZE:
+                evicted, _ = _model_pools.popitem(last=False)
+                logger.info(f"Evicted Whisper model from memory: {evicted[0]}")
+
+def detect_language(model, audio):
+    """Detect the spoken language from the first 30 seconds of decoded audio."""
+    if not model.is_multilingual:
+        return "en"
+    
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels).to(model.device)
+    _, probs = model.detect_language(mel)
+    language = max(probs, key=probs.get)
+    logger.info(f"Detected language: {language}")
+    return language
+
+def _shift_segment(segment, offset_seconds, segment_id):
+    """Move a segment from chunk-relative to file-relative time."""
+    segment = dict(segment)
+    segment["id"] = segment_id
+    segment["seek"] = segment.get("seek", 0) + round(offset_seconds * 100)
+    segment["start"] += offset_seconds
+    segment["end"] += offset_seconds
+    if segment.get("words"):
+        segment["words"] = [
+            {**word, "start": word["start"] + offset_seconds, "end": word["end"] + offset_seconds}
+            for word in segment["words"]
         ]
+    return segment
+
+def transcribe_with_checkpoints(model, audio, job_key, guard=None, **options):
+    """
+    Transcribe long audio in chunks, saving a checkpoint after each one.
+    
+    Each checkpoint holds the finished segments, the audio offset to continue
+    from, the previous text used as decoder context and the repetition guard's
+    recent window texts. If a checkpoint for `job_key` exists the job resumes
+    there instead of at offset zero, so a resumed job produces the same output
+    as an uninterrupted one.
+    
+    Temperature fallback samples from torch's global RNG (Whisper's decoder
+    takes no generator). Each chunk reseeds it from its offset, but only while
+    this is the only job decoding in the process (e.g. in the batch CLI, where
+    each worker process runs one job), so other jobs' sampling is never reset.
+    Jobs that run next to others and fall back to sampling may differ on resume.
+    
+    Args:
+        model: Loaded Whisper model
+        audio: Decoded 16kHz audio samples
+        job_key: Key of the job in the job store
+        guard: RepetitionGuard active on the model, if any
+        options: Options passed to model.transcribe (language must be set)
+    
+    Returns:
+        Dictionary with transcription result
+    """
+    sample_rate = whisper.audio.SAMPLE_RATE
+    chunk_samples = int(CHECKPOINT_CHUNK_SECONDS * sample_rate)
+    condition_on_previous_text = options.get("condition_on_previous_text", True)
+    
+    job_store.purge_stale_checkpoints()
+    checkpoint = job_store.load_checkpoint(job_key)
+    if checkpoint:
+        logger.info(f"Resuming job {job_key[:12]} from {checkpoint['offset'] / sample_rate:.1f}s")
+    else:
+        checkpoint = {"offset": 0, "segments": [], "prompt": None}
+    
+    offset = checkpoint["offset"]
+    segments = checkpoint["segments"]
+    prompt = checkpoint["prompt"]
+    if guard:
+        # Skip decisions depend on the windows decoded before the checkpoint
+        guard.restore_history(checkpoint.get("guard_history", []))
+    
+    while offset < len(audio):
+        chunk_end = min(offset + chunk_samples, len(audio))
+        is_last = chunk_end == len(audio)
+        offset_seconds = offset / sample_rate
         
-        logger.debug(f"Running FFmpeg command: {' '.join(cmd)}")
+        # Seed from the offset so temperature fallback sampling is reproducible (see above)
+        with _model_pools_lock:
+            alone = _models_in_use == 1
+        if alone:
+            torch.manual_seed(offset)
+        result = model.transcribe(audio[offset:chunk_end], initial_prompt=prompt, **options)
+        chunk_segments = result["segments"]
         
-        # Run the command
-        result = subprocess.run(
-            cmd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        if not is_last and len(chunk_segments) > 1:
+            # The last segment may be cut at the chunk boundary; decode it again with the next chunk
+            chunk_segments = chunk_segments[:-1]
+            next_offset = offset + int(chunk_segments[-1]["end"] * sample_rate)
+        else:
+            next_offset = chunk_end
+        
+        for segment in chunk_segments:
+            segments.append(_shift_segment(segment, offset_seconds, len(segments)))
         
-        if result.returncode != 0:
-            logger.error(f"FFmpeg error: {result.stderr}")
-            raise Exception(f"FFmpeg error: {result.stderr}")
+        if condition_on_previous_text:
+            prompt = "".join(segment["text"] for segment in segments)[-PROMPT_CONTEXT_CHARS:] or None
         
-        return audio_path
+        # Guarantee progress even if a segment ends at the chunk start
+        offset = max(next_offset, offset + sample_rate)
+        
+        if not is_last:
+            job_store.save_checkpoint(job_key, {
+                "offset": offset,
+                "segments": segments,
+                "prompt": prompt,
+                "guard_history": guard.get_history() if guard else [],
+                "language": options.get("language")
+            })
+            logger.info(f"Checkpointed job {job_key[:12]} at {offset / sample_rate:.1f}s")
     
-    except Exception as e:
-        logger.error(f"Audio extraction error: {str(e)}")
-        raise Exception(f"Failed to extract audio: {str(e)}")
+    job_store.delete_checkpoint(job_key)
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "language": options.get("language")
+    }
 
-def transcribe_audio(file_path, model_name="base", language=None, task="transcribe"):
+def transcribe_multi_task(file_path, model_name="base", language=None, tasks=("transcribe", "translate"),
+                          cache_audio=True, preset=decode_presets.DEFAULT_PRESET, file_hash=None):
     """
-    Transcribe audio or video file using Whisper model.
+    Run several decoding tasks over one audio or video file in a single job.
+    
+    The media is decoded once, the language is detected once and every task
+    runs on the same resident model instance, reusing encoder output across
+    temperature fallbacks.
     
     Args:
         file_path: Path to audio or video file
         model_name: Whisper model to use (tiny, base, small, medium, large)
         language: Language code (optional, auto-detected if None)
-        task: "transcribe" or "translate" (to English)
+        tasks: Sequence of "transcribe" and/or "translate" (to English)
+        cache_audio: Keep the decoded audio in the audio cache for later runs
+        preset: Decoding speed preset (see decode_presets.DECODE_PRESETS)
+        file_hash: SHA-256 of the file if the caller already has it
     
     Returns:
-        Dictionary with transcription result
+        Dictionary mapping each task to its transcription result
     """
     try:
         # Check if CUDA is available
         device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"Using device: {device}")
         
-        # Handle video files - extract audio first
-        file_extension = os.path.splitext(file_path)[1].lower()
-        if file_extension in ['.mp4', '.avi', '.mov', '.webm']:
-            logger.info(f"Extracting audio from video file: {file_path}")
-            audio_path = extract_audio(file_path)
-            logger.info(f"Audio extracted to: {audio_path}")
-        else:
-            audio_path = file_path
-        
-        # Load the Whisper model
-        logger.info(f"Loading Whisper model: {model_name}")
-        model = whisper.load_model(model_name, device=device)
-        
-        # Prepare options
-        options = {
-            "task": task,
-        }
-        
-        if language:
-            options["language"] = language
-        
-        # Run transcription
-        logger.info(f"Starting transcription with options: {options}")
-        result = model.transcribe(audio_path, **options)
-        
-        # Clean up the temporary audio file if extracted
-        if audio_path != file_path:
-            os.unlink(audio_path)
+        # Wait for a free inference slot so concurrent jobs don't oversubscribe the CPU
+        with concurrency_governor.governor.job() as threads:
+            torch.set_num_threads(threads)
+            logger.info(f"Running with a budget of {threads} threads")
+            
+            # Decode the media once for all tasks, reusing an earlier decode of this upload
+            logger.info(f"Decoding audio from: {file_path}")
+            if cache_audio:
+                audio = audio_cache.load_audio(file_path, lambda: decode_audio(file_path, threads=threads))
+            else:
+                audio = decode_audio(file_path, threads=threads)
+            
+            # Long jobs are checkpointed so a killed worker can resume them
+            checkpointed = len(audio) >= CHECKPOINT_MIN_SECONDS * whisper.audio.SAMPLE_RATE
+            if checkpointed and not file_hash:
+                file_hash = job_store.hash_file(file_path)
+            
+            results = {}
+            with checkout_model(model_name, device) as model, _encoder_cache(model, EncoderCache()) as cache:
+                # Pin the language so every task decodes the same source language
+                if not language:
+                    language = detect_language(model, audio)
+                
+                for task in tasks:
+                    options = {
+                        "task": task,
+                        "language": language,
+                        **decode_presets.get_decode_options(preset)
+                    }
+                    
+                    # Run transcription, skipping windows stuck in repetition loops if the preset opts in
+                    logger.info(f"Starting transcription with options: {options}")
+                    guard = None
+                    if preset in decode_presets.REPETITION_GUARD_PRESETS:
+                        guard = decode_presets.RepetitionGuard(
+                            options["temperature"],
+                            options["compression_ratio_threshold"],
+                            options["logprob_threshold"]
+                        )
+                    with _repetition_guard(model, guard):
+                        if checkpointed:
+                            job_key = job_store.make_job_key(file_hash, model=model_name, **options)
+                            results[task] = transcribe_with_checkpoints(model, audio, job_key, guard, **options)
+                        else:
+                            results[task] = model.transcribe(audio, **options)
+                    
+                    if guard:
+                        decode_stats = guard.get_stats()
+                        decode_presets.record_job_stats(decode_stats)
+                        results[task]["decode_stats"] = decode_stats
+                        if decode_stats["windows_skipped"]:
+                            logger.info(f"Repetition guard skipped {decode_stats['windows_skipped']} windows,"
+                                        f" saving about {decode_stats['estimated_seconds_saved']:.1f}s of decoding")
+            
+            logger.info(f"Encoder cache: {cache.hits} hits, {cache.misses} misses")
         
         logger.info("Transcription completed successfully")
-        return result
+        return results
     
     except Exception as e:
         logger.error(f"Transcription error: {str(e)}")
         raise Exception(f"Transcription failed: {str(e)}")
+
+def transcribe_audio(file_path, model_name="base", language=None, task="transcribe",
+                     preset=decode_presets.DEFAULT_PRESET):
+    """
+    Transcribe audio or video file using Whisper model.
+    
+    Args:
+        file_path: Path to audio or video file
+        model_name: Whisper model to use (tiny, base, small, medium, large)
+        language: Language code (optional, auto-detected if None)
+        task: "transcribe" or "translate" (to English)
+        preset: Decoding speed preset (see decode_presets.DECODE_PRESETS)
+    
+    Returns:
+        Dictionary with transcription result
+    """
+    return transcribe_multi_task(file_path, model_name, language, tasks=(task,), preset=preset)[task]